@@ -6,6 +6,8 @@ from collections import defaultdict
 import numpy as np
 import matplotlib.pyplot as plt
 
+from pypoc.reader import run_summary, is_results_file
+
 logging.basicConfig(level=logging.DEBUG)
 LOGGER = logging.getLogger(__name__)
 
@@ -17,7 +19,7 @@ def plot_avg_delay(filedirectory):
     batch_sets = defaultdict(list)
 
     for filename in os.listdir(filedirectory):
-        if filename[-3:] == 'csv':
+        if is_results_file(filename):
             batch_name = filename[:filename.index('_')]
             batch_sets[batch_name].append(os.path.join(filedirectory, filename))
     input(batch_sets)
@@ -26,36 +28,10 @@ def plot_avg_delay(filedirectory):
         delays = []
         x_numbers = []
         for filepath in sorted(batch_sets[batch_key], key=get_num):
-            delay = []
-            step_value = None
-            with open(filepath, 'r') as f:
-                current_packet = None
-                born_tick = None
-                died_tick = None
-                for line in f.readlines():
-                    if step_value is None:
-                        if 'step_value' in line:
-                            step_value = float(line.split(',')[1])
-
-                    if 'packet' in line and 'path' in line and 'dest-nodes' in line:
-                        current_packet = int(line.split(',')[0].split('_')[1])
-                        LOGGER.debug(f'Current packet: {current_packet}')
-                        continue
-                    if current_packet:
-                        if f'packet_{current_packet}' in line and 'born_tick' in line:
-                            born_tick = int(line.split(',')[1])
-                            LOGGER.debug(f'Reading born tick: {born_tick}')
-
-                        if f'packet_{current_packet}' in line and 'died_tick' in line:
-                            died_tick = int(line.split(',')[1])
-
-                            LOGGER.debug(f'Reading died tick: {died_tick}')
-                            delay.append(died_tick - born_tick)
-                            current_packet = None
-                            born_tick = None
-                            died_tick = None
+            summary = run_summary(filepath)
+            LOGGER.debug(f'Read the delay of {summary["arrived_delays"]} packets from {filepath}')
 
-            delays.append(step_value*(sum(delay)/len(delay)*30))
+            delays.append(summary['step_value']*(summary['average_delay']*30))
             x_numbers.append(get_num(filepath))
         input(batch_key)
         if 'BASELINE' in batch_key:
@@ -7,6 +7,8 @@ import numpy as np
 from scipy.optimize import curve_fit
 import matplotlib.pyplot as plt
 
+from pypoc.reader import run_summary, is_results_file
+
 logging.basicConfig(level=logging.DEBUG)
 LOGGER = logging.getLogger(__name__)
 
@@ -18,7 +20,7 @@ def plot_file(filedirectory):
     batch_sets = defaultdict(list)
 
     for filename in os.listdir(filedirectory):
-        if filename[-3:] == 'csv':
+        if is_results_file(filename):
             batch_name = filename[:filename.index('_')]
             batch_sets[batch_name].append(os.path.join(filedirectory, filename))
 
@@ -26,12 +28,8 @@ def plot_file(filedirectory):
         drop_movement = []
         x_numbers = []
         for filepath in sorted(batch_sets[batch_key], key=get_num):
-            with open(filepath, 'r') as f:
-                for line in f.readlines():
-                    if 'drop_rate_value' in line:
-                        value = (1/float(line.split(',')[1]))*100
-                        drop_movement.append(value)
-                        break
+            value = (1/float(run_summary(filepath)['drop_rate_value']))*100
+            drop_movement.append(value)
             x_numbers.append(get_num(filepath))
         if batch_key == 'BASELINE':
             color = 'darkgrey'
@@ -7,6 +7,8 @@ import numpy as np
 from scipy.optimize import curve_fit
 import matplotlib.pyplot as plt
 
+from pypoc.reader import run_summary, is_results_file
+
 logging.basicConfig(level=logging.DEBUG)
 LOGGER = logging.getLogger(__name__)
 
@@ -18,7 +20,7 @@ def plot_file(filedirectory):
     batch_sets = defaultdict(list)
 
     for filename in os.listdir(filedirectory):
-        if filename[-3:] == 'csv':
+        if is_results_file(filename):
             batch_name = filename[:filename.index('_')]
             batch_sets[batch_name].append(os.path.join(filedirectory, filename))
 
@@ -26,22 +28,11 @@ def plot_file(filedirectory):
         throughput_movement = []
         x_numbers = []
         for filepath in sorted(batch_sets[batch_key], key=get_num):
-            with open(filepath, 'r') as f:
-                for line in f.readlines():
-                    if 'throughput_list' in line:
-                        values = line.split(',')[1:]
-                        if batch_key == 'Q-OFFLOADING':
-                            error = 1.0e7
-                        else:
-                            error = 1.0e4
-                        values = [float(v)+error for v in values]
-                        avg_value = sum(values)/len(values)
-                        try:
-                            throughput_movement.append(avg_value)
-                            break
-                        except IndexError:
-                            input(f"IndexError for {filepath}; on row: {row}")
-                            raise
+            if batch_key == 'Q-OFFLOADING':
+                error = 1.0e7
+            else:
+                error = 1.0e4
+            throughput_movement.append(float(run_summary(filepath)['throughput_mean'])+error)
             x_numbers.append(get_num(filepath))
         if batch_key == 'BASELINE':
             color = 'darkgrey'
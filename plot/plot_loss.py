@@ -3,30 +3,28 @@ import logging
 
 import matplotlib.pyplot as plt
 
+from pypoc.reader import read_results
+
 logging.basicConfig(level=logging.DEBUG)
 LOGGER = logging.getLogger(__name__)
 
 def plot_file(filepaths):
     for filepath in filepaths:
-        with open(filepath, 'r') as f:
-            loss = []
-            for line in f.readlines():
-                print(line.split(',')[0])
-                if '_loss' in line:
-                    if 'node_168' in line:
-                        continue
-                    LOGGER.debug('Reading loss line')
-                    l = line.split(',')[1:]
-                    l = [float(n) for n in l]
-
-                    l.reverse()
-                    l_true = l[:400]
-                    print(l)
-                    filtered = [i for i in l[400:] if i < 1.7]
-                    l_true.extend(filtered)
-                    loss.append(l_true)
-
-                    plt.plot(l_true, label=line.split(',')[0])
+        run = read_results(filepath)
+        loss = []
+        for key in run.matching('nodes/*/loss'):
+            if 'node_168' in key:
+                continue
+            LOGGER.debug(f'Reading loss of {key}')
+            l = run[key].tolist()
+
+            l.reverse()
+            l_true = l[:400]
+            filtered = [i for i in l[400:] if i < 1.7]
+            l_true.extend(filtered)
+            loss.append(l_true)
+
+            plt.plot(l_true, label=key)
 
     plt.legend()
     plt.title('Loss per training epochs')
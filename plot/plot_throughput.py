@@ -4,20 +4,15 @@ import logging
 import numpy as np
 import matplotlib.pyplot as plt
 
+from pypoc.reader import read_results
+
 logging.basicConfig(level=logging.DEBUG)
 LOGGER = logging.getLogger(__name__)
 
 def plot_file(filepaths):
     for filepath in filepaths:
-        throughput = []
-        with open(filepath, 'r') as f:
-            for line in f.readlines():
-                if 'throughput_list' in line:
-                    LOGGER.debug('Reading throughput line')
-                    throughput = line.split(',')[1:]
-                    throughput = [float(n) for n in throughput]
-                    LOGGER.debug(f'Length of throughpus recorded: {len(throughput)}')
-                    break
+        throughput = read_results(filepath).get('network/throughput_list', [])
+        LOGGER.debug(f'Length of throughpus recorded: {len(throughput)}')
 
         if filepath == 'set_one_data/OSPF.csv':
             name = 'OSPF (1)'
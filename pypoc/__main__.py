@@ -3,14 +3,18 @@ Main entry script for PyPoc. Reads the config and
 creates & runs a Network.
 '''
 import os
+import sys
 import toml
 import argparse
 import shutil
 from pathlib import Path
 from datetime import datetime, timedelta
 
-import pypoc.network as network
-import pypoc.plotter as plotter
+# The simulation core is imported when it is used, so that the other commands
+# start fast; see pypoc.importtimes
+import pypoc.results as results
+import pypoc.sweep as sweep
+from pypoc.resultcache import ResultCache
 
 __author__ = 'Hans Hofner'
 
@@ -32,19 +36,92 @@ parser.add_argument('--datafile4', nargs='*', help='Data files to plot.', defaul
 
 parser.add_argument('--run', action='store_true', help='Run a simulation.')
 parser.add_argument('--config', default='config.toml', help='Specific configuration file, optional.')
+parser.add_argument('--engine', choices=['tick', 'event'], default=None, help='Simulation engine, overrides the config.')
+parser.add_argument('--sweep', nargs=4, metavar=('KEY', 'START', 'END', 'STEP'), default=None,
+                    help='Run the config for KEY (e.g. nodes.src-nodes.count) from START to END (exclusive).')
+parser.add_argument('--workers', type=int, default=None, help='Worker processes of a sweep; one per CPU by default.')
+parser.add_argument('--cache', default=None, help='Result cache directory of a sweep; cached points are not run again.')
+parser.add_argument('--cache-max-gb', type=float, default=None, help='Size the result cache is kept under.')
+parser.add_argument('--cache-max-days', type=float, default=None, help='Days the result cache keeps unused runs.')
+parser.add_argument('--export-csv', nargs='+', default=None, help='Write results files as CSV files next to them.')
+parser.add_argument('--profile', nargs='?', const='', default=None, metavar='JSON',
+                    help='Time the phases of a run; the report goes to JSON, by default next to the data file.')
+parser.add_argument('--benchmark', nargs='?', const='', default=None, metavar='JSON',
+                    help='Run the scaling benchmark; results go to JSON, by default benchmark_<commit>.json.')
+parser.add_argument('--benchmark-baseline', default=None, metavar='JSON',
+                    help='Benchmark results to compare with; exits with 1 on a regression.')
+parser.add_argument('--benchmark-threshold', type=float, default=0.1,
+                    help='Fraction a benchmark metric may get worse by before it is a regression.')
+parser.add_argument('--benchmark-scenarios', nargs='+', default=None, help='Benchmark scenarios to run; all by default.')
+parser.add_argument('--benchmark-repeats', type=int, default=1, help='Runs of every benchmark scenario; the best counts.')
+parser.add_argument('--import-times', action='store_true', help='Measure the import time of every subsystem.')
 parser.add_argument('--output_dir', default='/Users/hhofner/Documents/katolab/PyPoc/output_data')
 
 args = parser.parse_args()
-configuration = toml.load(args.config)
+configuration = toml.load(args.config) if args.run or args.sweep else None
+
+if args.import_times:
+    import pypoc.importtimes as importtimes
+    importtimes.print_report(importtimes.measure())
+
+if args.benchmark is not None:
+    import pypoc.benchmark as benchmark
+    measured = benchmark.run_benchmark(args.benchmark_scenarios, repeats=args.benchmark_repeats)
+    benchmark_filepath = args.benchmark or f'benchmark_{(measured["commit"] or "results")[:10]}.json'
+    benchmark.write_results(measured, benchmark_filepath)
+    baseline = benchmark.read_results(args.benchmark_baseline) if args.benchmark_baseline else None
+    benchmark.print_report(measured, baseline)
+    print(f'Benchmark written to {benchmark_filepath}')
+    if baseline is not None:
+        regressions = benchmark.compare(measured, baseline, args.benchmark_threshold)
+        for name, metric, before, value, change in regressions:
+            print(f'REGRESSION {name} {metric}: {before:.2f} -> {value:.2f} ({100 * change:.1f}% worse)')
+        if regressions:
+            sys.exit(1)
+
+if args.export_csv:
+    for results_filepath in args.export_csv:
+        csv_filepath = os.path.splitext(results_filepath)[0] + '.csv'
+        results.export_csv(results_filepath, csv_filepath)
+        print(f'Exported {results_filepath} to {csv_filepath}')
 
 if args.run:
+    if args.engine is not None:
+        configuration['global']['engine'] = args.engine
     title = configuration["title"]
     # Copy file
     shutil.copyfile(args.config, f'{args.output_dir}/{title}.toml')
     # Create simulation data file
-    data_filename = f'{title}_{datetime.now().strftime("%d%b%y_%H_%M_%S")}.csv'
+    extension = '.csv' if configuration['global'].get('output-format') == 'csv' else results.ResultsWriter.extension
+    data_filename = f'{title}_{datetime.now().strftime("%d%b%y_%H_%M_%S")}{extension}'
     data_filepath = os.path.join(args.output_dir, data_filename)
     Path(data_filepath).touch()
 
+    import pypoc.network as network
+    profiler = None
+    if args.profile is not None:
+        from pypoc.profiler import Profiler
+        profiler = Profiler()
     new = network.PyPocNetwork()
-    new.run_network_with(configuration, **{'filename': data_filepath})
+    new.run_network_with(configuration, **{'filename': data_filepath, 'profiler': profiler})
+    if profiler is not None:
+        profile_filepath = args.profile or os.path.splitext(data_filepath)[0] + '.profile.json'
+        profiler.write_json(profile_filepath)
+        print(profiler.format_table())
+        print(f'Profile written to {profile_filepath}')
+
+if args.sweep:
+    key, start, end, step = args.sweep
+    points = sweep.sweep_points(configuration, key, range(int(start), int(end), int(step)), configuration['title'])
+    cache = None
+    if args.cache:
+        cache = ResultCache(args.cache,
+                            max_size=None if args.cache_max_gb is None else args.cache_max_gb * 1e9,
+                            max_age=None if args.cache_max_days is None else args.cache_max_days * 86400)
+    failed = []
+    for result in sweep.run_sweep(points, args.output_dir, workers=args.workers, cache=cache):
+        print(result)
+        if result.failed:
+            print(result.error)
+            failed.append(result.point.title)
+    print(f'Sweep finished; {len(points) - len(failed)} of {len(points)} runs done, failed: {failed}')
@@ -0,0 +1,230 @@
+'''
+Scaling benchmark of the simulator.
+
+Every scenario is `template_config.toml` with a few keys changed, e.g. more
+src-nodes, relays (uav-base-stations) or q-stations, and a fixed seed, so the
+same scenario does the same work on every commit. Each scenario runs in a
+fresh interpreter and reports
+
+    ticks_per_second    ticks of the main loop per second of wall time
+    packets_per_second  packets generated per second of the main loop
+    peak_rss_mb         peak resident memory of the process
+    startup_seconds     from starting the process to the first tick
+
+The results are a JSON file; `compare` holds them against the results of
+another commit and lists the metrics that got worse by more than a threshold:
+
+    python -m pypoc --benchmark before.json
+    python -m pypoc --benchmark after.json --benchmark-baseline before.json
+
+Nothing is downloaded and nothing but the standard library and the simulator
+itself is needed; peak memory is read with `resource`, so on Linux (and other
+Unix systems).
+'''
+
+__author__ = 'Hans Hofner'
+
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from pypoc.profiler import Profiler
+from pypoc.resultcache import simulator_version
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASE_CONFIGURATION = os.path.join(ROOT, 'template_config.toml')
+
+# Scenario -> dotted keys of the base configuration it changes; the runs are
+# shortened so that the whole suite takes minutes (Q-stations train a model
+# every tick, so their runs are the shortest)
+SCENARIOS = {f'src-nodes-{count}': {'nodes.src-nodes.count': count, 'global.minutes': 0.5}
+             for count in (50, 100, 250, 500, 1000)}
+SCENARIOS.update({f'relays-{count}': {'nodes.uav-base-stations.count': count, 'global.minutes': 0.5}
+                  for count in (0, 2, 4, 6)})
+SCENARIOS.update({f'q-stations-{count}': {'nodes.q-stations.count': count, 'global.minutes': 0.05}
+                  for count in (1, 2, 4)})
+
+# Metric -> True if higher is better
+METRICS = {'ticks_per_second': True, 'packets_per_second': True, 'peak_rss_mb': False, 'startup_seconds': False}
+
+DEFAULT_THRESHOLD = 0.1
+
+_PROBE = '''
+import json, resource, sys, time
+from pypoc.benchmark import RunClock
+from pypoc.simulation import run_simulation
+clock = RunClock()
+run = run_simulation(sys.argv[1], json.loads(sys.argv[2]), quiet=True, profiler=clock)
+print(json.dumps({{'started': clock.started, 'wall': clock.wall, 'cpu': clock.cpu, 'ticks': clock.ticks,
+                  'packets': run.summary['packet_generated_value'],
+                  'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * {rss_unit}}}))
+'''
+
+
+class RunClock(Profiler):
+    '''
+    Profiler that only times the main loop, without timers on its phases.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.started = None  # Epoch seconds of the first tick
+
+    def instrument(self, network):
+        pass
+
+    def start(self):
+        self.started = time.time()
+        super().start()
+
+
+def run_scenario(overrides, configuration=BASE_CONFIGURATION):
+    '''
+    Run a scenario in a fresh interpreter.
+
+    :param overrides: Dict of dotted key -> value to set in the configuration.
+    :param configuration: Path of the TOML base configuration.
+    :return: Dict of METRICS and the 'ticks', 'packets', 'wall' and 'cpu'
+             seconds of the main loop.
+    '''
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, environment.get('PYTHONPATH')]))
+    with tempfile.TemporaryDirectory() as directory:
+        spawned = time.time()
+        output = subprocess.run([sys.executable, '-c', _PROBE.format(rss_unit=rss_unit),
+                                 os.path.abspath(configuration), json.dumps(overrides)],
+                                capture_output=True, text=True, cwd=directory, env=environment)
+    if output.returncode != 0:
+        raise Exception(f'Scenario {overrides} failed:\n{output.stderr}')
+    measured = json.loads(output.stdout.strip().splitlines()[-1])
+    return {'ticks_per_second': measured['ticks'] / measured['wall'],
+            'packets_per_second': measured['packets'] / measured['wall'],
+            'peak_rss_mb': measured['peak_rss'] / 2 ** 20,
+            'startup_seconds': measured['started'] - spawned,
+            'ticks': measured['ticks'], 'packets': measured['packets'],
+            'wall': measured['wall'], 'cpu': measured['cpu']}
+
+
+def _best(runs):
+    '''
+    :return: The run with the best of every metric over `runs`.
+    '''
+    best = dict(runs[0])
+    for run in runs[1:]:
+        for metric, higher_is_better in METRICS.items():
+            best[metric] = (max if higher_is_better else min)(best[metric], run[metric])
+    return best
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=ROOT,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scenarios=None, repeats=1, configuration=BASE_CONFIGURATION):
+    '''
+    :param scenarios: Names of SCENARIOS to run; None for all.
+    :param repeats: Runs of every scenario; the best of each metric is kept.
+    :param configuration: Path of the TOML base configuration.
+    :return: JSON serializable dict of the machine, the commit and the
+             'scenarios', name -> run_scenario dict, or 'error' for a
+             scenario that failed.
+    '''
+    if repeats < 1:
+        raise Exception(f'Incorrect repeats {repeats}; must be 1 or more')
+    results = {}
+    for name in scenarios or SCENARIOS:
+        try:
+            results[name] = _best([run_scenario(SCENARIOS[name], configuration) for _ in range(repeats)])
+            results[name]['overrides'] = SCENARIOS[name]
+        except Exception as e:
+            LOGGER.error(f'Benchmark scenario {name} failed')
+            results[name] = {'overrides': SCENARIOS[name], 'error': str(e)}
+    return {'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': _commit(),
+            'simulator': simulator_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeats': repeats,
+            'configuration': os.path.basename(configuration),
+            'scenarios': results}
+
+
+def write_results(results, filepath):
+    with open(filepath, 'w') as f:
+        json.dump(results, f, indent=1)
+
+
+def read_results(filepath):
+    with open(filepath) as f:
+        return json.load(f)
+
+
+def _comparable(before, measured):
+    '''
+    :return: True if two results of a scenario ran the same scenario and
+             neither failed.
+    '''
+    return (before is not None and 'error' not in before and 'error' not in measured
+            and before['overrides'] == measured['overrides'])
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    '''
+    :param results: run_benchmark dict.
+    :param baseline: run_benchmark dict to compare with, e.g. of the
+                     previous commit.
+    :param threshold: Fraction a metric may get worse by, e.g. 0.1 for 10%.
+    :return: List of (scenario, metric, baseline value, value, change) of the
+             regressions; change is the fraction the metric got worse by.
+             Scenarios that are not in both, failed or were changed are
+             left out.
+    '''
+    if threshold < 0:
+        raise Exception(f'Incorrect threshold {threshold}; must be 0 or more')
+    regressions = []
+    for name, measured in results['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not _comparable(before, measured):
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if not before[metric]:
+                continue
+            change = (measured[metric] - before[metric]) / before[metric]
+            worse = -change if higher_is_better else change
+            if worse > threshold:
+                regressions.append((name, metric, before[metric], measured[metric], worse))
+    return regressions
+
+
+def print_report(results, baseline=None):
+    '''
+    Print the scenarios of `results` as a table, with the change from
+    `baseline` for each metric if given.
+    '''
+    print(f'{"scenario":<16} {"ticks/s":>10} {"packets/s":>10} {"rss MB":>8} {"startup s":>9}')
+    for name, measured in results['scenarios'].items():
+        if 'error' in measured:
+            print(f'{name:<16} FAILED: {measured["error"].strip().splitlines()[-1]}')
+            continue
+        print(f'{name:<16} {measured["ticks_per_second"]:>10.1f} {measured["packets_per_second"]:>10.1f} '
+              f'{measured["peak_rss_mb"]:>8.1f} {measured["startup_seconds"]:>9.2f}')
+        before = (baseline or {}).get('scenarios', {}).get(name)
+        if _comparable(before, measured):
+            changes = [f'{100 * (measured[metric] - before[metric]) / before[metric]:+.1f}%' if before[metric] else '-'
+                       for metric in METRICS]
+            print(f'{"":<16} {changes[0]:>10} {changes[1]:>10} {changes[2]:>8} {changes[3]:>9}')
@@ -0,0 +1,236 @@
+'''
+Online statistics of packet delays.
+
+A packet's delay, died tick - born tick, is added to histograms when it
+arrives or is dropped, so the average delay and delay percentiles of a run
+are known without keeping a record of every packet. The histograms have
+log-linear buckets: delays below EXACT_TICKS ticks get a bucket of their own,
+and above that every power of two is split into SUB_BUCKETS buckets, so a
+percentile is off by less than 1/SUB_BUCKETS of its value while a histogram
+stays a few hundred counts long however long the run.
+
+DelayStats keeps one histogram per outcome for all packets and one per
+outcome for every (source class, destination class) pair, and exports them
+as arrays of counts by bucket:
+
+    delays/bucket_ticks               lowest delay of every bucket, in ticks
+    delays/<outcome>                  all packets
+    delays/<source>/<destination>/<outcome>
+'''
+
+__author__ = 'Hans Hofner'
+
+import logging
+
+import numpy as np
+
+from pypoc.results import ARRIVED, DROPPED
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+EXACT_TICKS = 2 * SUB_BUCKETS
+PERCENTILES = (50, 90, 95, 99)
+OUTCOMES = {ARRIVED: 'arrived', DROPPED: 'dropped'}
+# Keys of the delay values in the summary of a run, see DelayStats.summary
+SUMMARY_KEYS = ('arrived_delays', 'average_delay', 'delay_max') + tuple(f'delay_p{p}' for p in PERCENTILES)
+
+
+def bucket_of(delay):
+    '''
+    :return: Bucket of `delay`, an int of ticks.
+    '''
+    if delay < EXACT_TICKS:
+        return delay
+    shift = delay.bit_length() - SUB_BUCKET_BITS - 1
+    return EXACT_TICKS + (shift - 1) * SUB_BUCKETS + (delay >> shift) - SUB_BUCKETS
+
+
+def buckets_of(delays):
+    '''
+    :return: Array of the buckets of an array of delays.
+    '''
+    delays = np.asarray(delays, dtype=np.int64)
+    shift = np.maximum(np.frexp(delays.astype(np.float64))[1] - SUB_BUCKET_BITS - 1, 1)
+    buckets = EXACT_TICKS + (shift - 1) * SUB_BUCKETS + (delays >> shift) - SUB_BUCKETS
+    return np.where(delays < EXACT_TICKS, delays, buckets)
+
+
+def bucket_ticks(count):
+    '''
+    :return: Array of the lowest delay of the first `count` buckets.
+    '''
+    buckets = np.arange(count, dtype=np.int64)
+    shift = np.maximum((buckets - EXACT_TICKS) // SUB_BUCKETS + 1, 0)
+    mantissa = np.where(buckets < EXACT_TICKS, buckets, SUB_BUCKETS + (buckets - EXACT_TICKS) % SUB_BUCKETS)
+    return mantissa << shift
+
+
+class DelayHistogram:
+    '''
+    Log-linear histogram of delays in ticks, with their exact count, sum and
+    maximum.
+    '''
+    def __init__(self):
+        self.counts = []  # Bucket -> delays
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def from_delays(cls, delays):
+        '''
+        :param delays: Array of delays in ticks.
+        '''
+        histogram = cls()
+        delays = np.asarray(delays, dtype=np.int64)
+        if len(delays):
+            histogram.counts = np.bincount(buckets_of(delays)).tolist()
+            histogram.count = len(delays)
+            histogram.total = int(delays.sum())
+            histogram.max = int(delays.max())
+        return histogram
+
+    @classmethod
+    def from_counts(cls, counts):
+        '''
+        :param counts: Array of counts by bucket, as exported. The sum and
+                       maximum are estimated from the buckets.
+        '''
+        histogram = cls()
+        counts = np.asarray(counts, dtype=np.int64)
+        histogram.counts = counts.tolist()
+        histogram.count = int(counts.sum())
+        if histogram.count:
+            values = _bucket_values(len(counts))
+            histogram.total = int(np.dot(values, counts))
+            histogram.max = int(values[np.flatnonzero(counts)[-1]])
+        return histogram
+
+    def add(self, delay):
+        bucket = bucket_of(delay)
+        counts = self.counts
+        if bucket >= len(counts):
+            counts.extend([0] * (bucket + 1 - len(counts)))
+        counts[bucket] += 1
+        self.count += 1
+        self.total += delay
+        if delay > self.max:
+            self.max = delay
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percentile):
+        '''
+        :return: Delay in ticks below which `percentile`% of the delays are,
+                 by nearest rank; None if the histogram is empty.
+        '''
+        if not self.count:
+            return None
+        rank = max(1, int(np.ceil(percentile / 100 * self.count)))
+        bucket = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(int(_bucket_values(bucket + 1)[bucket]), self.max)
+
+    def summary(self):
+        '''
+        :return: Dict of the count, mean, max and PERCENTILES ('p50', ...).
+        '''
+        summary = {'count': self.count, 'mean': self.mean(), 'max': self.max if self.count else None}
+        summary.update((f'p{percentile}', self.percentile(percentile)) for percentile in PERCENTILES)
+        return summary
+
+    def array(self):
+        return np.array(self.counts, dtype=np.int64)
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f'DelayHistogram(count:{self.count}, mean:{self.mean()})'
+
+
+class DelayStats:
+    '''
+    Delay histograms of the packets that died, for all packets and by source
+    and destination class, per outcome.
+    '''
+    # Class of the histograms of all packets
+    ALL = None
+
+    def __init__(self):
+        self.histograms = {}  # (source class, destination class, outcome) -> DelayHistogram
+
+    def add(self, packet, outcome):
+        '''
+        :param packet: Packet (or PacketRef) that just died.
+        :param outcome: ARRIVED or DROPPED.
+        '''
+        delay = packet.died_tick - packet.born_tick
+        for key in ((DelayStats.ALL, DelayStats.ALL, outcome),
+                    (getattr(packet.path[0], 'name', None), getattr(packet.destination, 'name', None), outcome)):
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = DelayHistogram()
+            histogram.add(delay)
+
+    def histogram(self, outcome=ARRIVED, source=ALL, destination=ALL):
+        '''
+        :param source: Class of the source nodes, or ALL.
+        :param destination: Class of the destination nodes, or ALL.
+        :return: DelayHistogram; empty if no such packet died.
+        '''
+        return self.histograms.get((source, destination, outcome)) or DelayHistogram()
+
+    def arrays(self):
+        '''
+        :return: Dict of array name -> counts by bucket, see the module.
+        '''
+        arrays = {}
+        for (source, destination, outcome), histogram in self.histograms.items():
+            if source is DelayStats.ALL:
+                arrays[f'delays/{OUTCOMES[outcome]}'] = histogram.array()
+            else:
+                arrays[f'delays/{source}/{destination}/{OUTCOMES[outcome]}'] = histogram.array()
+        if arrays:
+            arrays['delays/bucket_ticks'] = bucket_ticks(max(len(array) for array in arrays.values()))
+        return arrays
+
+    def summary(self):
+        '''
+        :return: Dict of the count ('arrived_delays'), mean ('average_delay'),
+                 max ('delay_max') and percentiles ('delay_p50', ...) of the
+                 delays of the arrived packets, in ticks, and the same by
+                 class pair ('delay_classes', keyed 'source->destination').
+        '''
+        summary = summary_of(self.histogram(ARRIVED))
+        summary['delay_classes'] = {f'{source}->{destination}': histogram.summary()
+                                    for (source, destination, outcome), histogram in self.histograms.items()
+                                    if source is not DelayStats.ALL and outcome == ARRIVED}
+        return summary
+
+    def __repr__(self):
+        return f'DelayStats(histograms:{len(self.histograms)})'
+
+
+def summary_of(histogram):
+    '''
+    :return: Summary values of the delays of the arrived packets, see
+             DelayStats.summary.
+    '''
+    summary = histogram.summary()
+    values = {'arrived_delays': summary.pop('count'),
+              'average_delay': summary.pop('mean'),
+              'delay_max': summary.pop('max')}
+    values.update((f'delay_{key}', value) for key, value in summary.items())
+    return values
+
+
+def _bucket_values(count):
+    '''
+    :return: Array of the delay a bucket stands for: its middle.
+    '''
+    lowest = bucket_ticks(count + 1)
+    return lowest[:-1] + (lowest[1:] - lowest[:-1]) // 2
@@ -1,9 +1,10 @@
-import pypoc.plotter
 import numpy as np
 
 import logging
+from collections import defaultdict
 
 from pypoc.mobility import MobilityEnum
+from pypoc.linkrules import REFRESH_RULES, positions_of
 from pypoc.node import RestrictedNode
 '''
 '''
@@ -45,31 +46,61 @@ class EdgeHandler:
             self._downlink_bandwidth_for[node] = \
                 self._config['nodes'][node]['params']['downlink-bandwidth']
 
+        self.link_rules = REFRESH_RULES
+
+        # Links of a node are only re-evaluated once it moved further than this
+        # (meters) from where they were last evaluated
+        self.move_tolerance = self._config['global'].get('move-tolerance', 0.0)
+        self._static_classes = {node for node in self._config['nodes']
+                                if MobilityEnum.get_movement(self._config['nodes'][node]['movement']) is None}
+        self._nodes_for = defaultdict(list)  # Node class -> nodes, in network order
+        self._evaluated_positions_for = {}  # Node class -> positions links were evaluated at
+        self._order = {}  # Node -> position in network order
+
         self.image_count = 0
 
+        # Edges are re-evaluated every `refresh_interval` ticks
+        self.refresh_interval = 10
+
         self.last_increase_tick = 0
         self.increase_length = None
         self.increase_rate = self._config['global']['increase-rate']
 
     # Main Entrance Method
     def handle_edges(self, networkx_object):
-        '''TODO Documentation
         '''
-        # "Handle" edges every 50 ticks
-        if not networkx_object.tick % 10:
+        Re-evaluate the edges of the network every `refresh_interval` ticks.
+
+        :return: True if the edges were refreshed on this tick.
+        '''
+        if self.is_refresh_tick(networkx_object.tick):
             if self.edge_foundation == 'distance':
                 self._handle_edges_based_on_distance(networkx_object)
 
             # reset important edge values of a node
-            networkx_object.initialize_step_values()
             self._reset_node_values(networkx_object)
 
             if SAVE_TO_IMAGES:
                 if not networkx_object.tick % 100:
                     self._save_images(networkx_object)
+            return True
+        return False
+
+    def is_refresh_tick(self, tick):
+        return not tick % self.refresh_interval
+
+    def next_refresh_tick(self, tick):
+        '''
+        :return: First tick after `tick` at which `handle_edges` refreshes.
+        '''
+        return (tick // self.refresh_interval + 1) * self.refresh_interval
 
     def _handle_edges_based_on_distance(self, networkx_object):
-        '''TODO Documentation
+        '''
+        Bring the edges in line with the node positions. Only edges touching
+        a node that moved more than `move_tolerance` since its links were last
+        evaluated are looked at; the pairs of those nodes that may link are
+        collected, and the difference is removed and added in bulk.
         '''
         #print('Handling Edges based on distance...')
         try:
@@ -77,29 +108,108 @@ class EdgeHandler:
         except:
             raise Exception(f'To use distance foundation, please set the area with `set_area()`.')
 
-        edge_list = []
         LOGGER.debug(f'BEFORE-Number of nodes: {len(list(networkx_object.nodes))}')
         self._increase_source_nodes(networkx_object)
-        for node in networkx_object.nodes:  # Go through every node
-            viable_connections = self._connections_for[node.name]  # Get list of nodes it can connect to
-            for node2 in networkx_object.nodes:
-                for vn in viable_connections:
-                    if self._is_distance_ok(node, node2) and not node is node2 and node2.name == vn:
-                        if not networkx_object.has_edge(node, node2):
-                            new_connection =\
-                                (node, node2, {'Bandwidth': self._downlink_bandwidth_for[node.name],
-                                               'TickValue': None,
-                                               'Channel': 0})
-                            #print(f'Adding new connection {new_connection}')
-                            edge_list.append(new_connection)
-                    elif not self._is_distance_ok(node, node2) and networkx_object.has_edge(node, node2):
-                        networkx_object.remove_edge(node, node2)
-                        #print(f'Removing edge: {node} -> {node2}')
-        if not len(edge_list) == 0:
-            networkx_object.add_edges_from(edge_list)
+
+        self._track_new_nodes(networkx_object)
+
+        # Current positions and indices of nodes to re-evaluate, per class.
+        # Nodes not evaluated yet have NaN evaluated positions, so they always
+        # count as moved
+        positions_for = {}
+        moved_for = {}
+        for name, nodes in self._nodes_for.items():
+            evaluated = self._evaluated_positions_for[name]
+            unevaluated = np.isnan(evaluated[:, 0])
+            if name in self._static_classes and not unevaluated.any():
+                positions_for[name] = evaluated
+                moved_for[name] = np.flatnonzero(unevaluated)
+            else:
+                positions_for[name] = positions_of(nodes)
+                moved_distance = np.linalg.norm(positions_for[name] - evaluated, axis=1)
+                moved_for[name] = np.flatnonzero(unevaluated | (moved_distance > self.move_tolerance))
+
+        # Every edge touching a moved node is re-evaluated
+        affected_edges = set()
+        for name, moved in moved_for.items():
+            nodes = self._nodes_for[name]
+            for i in moved.tolist():
+                node = nodes[i]
+                affected_edges.update((node, node2) for node2 in networkx_object.succ[node])
+                affected_edges.update((node2, node) for node2 in networkx_object.pred[node])
+
+        wanted_edges = set()
+        for name, moved in moved_for.items():
+            nodes = self._nodes_for[name]
+            for name2 in self._connections_for[name]:  # Node classes it can connect to
+                if name2 not in self._nodes_for:
+                    continue
+                nodes2 = self._nodes_for[name2]
+                moved2 = moved_for[name2]
+                if moved.size:
+                    # Links out of moved nodes
+                    link_mask = self.link_rules.link_matrix(name, positions_for[name][moved],
+                                                            name2, positions_for[name2])
+                    wanted_edges.update(self._pairs(link_mask, nodes, moved, nodes2, np.arange(len(nodes2))))
+                if moved2.size:
+                    # Links out of nodes that did not move, into moved nodes
+                    still = np.setdiff1d(np.arange(len(nodes)), moved, assume_unique=True)
+                    link_mask = self.link_rules.link_matrix(name, positions_for[name][still],
+                                                            name2, positions_for[name2][moved2])
+                    wanted_edges.update(self._pairs(link_mask, nodes, still, nodes2, moved2))
+
+        stale_edges = affected_edges - wanted_edges
+        new_edges = wanted_edges - affected_edges
+
+        # Add in node order, as the per-pair loop used to, so tie-breaks between
+        # equal cost paths do not depend on set ordering
+        order = self._order
+        edge_list = [(node, node2, {'Bandwidth': self._downlink_bandwidth_for[node.name],
+                                    'TickValue': None,
+                                    'Channel': 0})
+                     for node, node2 in sorted(new_edges, key=lambda e: (order[e[0]], order[e[1]]))]
+
+        networkx_object.remove_links(stale_edges)
+        networkx_object.add_links(edge_list)
+
+        for name, moved in moved_for.items():
+            if moved.size:
+                self._evaluated_positions_for[name][moved] = positions_for[name][moved]
 
         LOGGER.debug(f'AFTER-Number of nodes: {len(list(networkx_object.nodes))}')
 
+    def _track_new_nodes(self, networkx_object):
+        '''
+        Start tracking nodes added to the network since the last refresh. Their
+        evaluated position is NaN, so all their links are evaluated.
+        '''
+        if len(self._order) == networkx_object.number_of_nodes():
+            return
+        new_for = defaultdict(int)
+        for node in networkx_object.nodes:
+            if node not in self._order:
+                self._order[node] = len(self._order)
+                self._nodes_for[node.name].append(node)
+                new_for[node.name] += 1
+        for name, count in new_for.items():
+            unevaluated = np.full((count, 3), np.nan)
+            if name in self._evaluated_positions_for:
+                unevaluated = np.vstack((self._evaluated_positions_for[name], unevaluated))
+            self._evaluated_positions_for[name] = unevaluated
+
+    @staticmethod
+    def _pairs(link_mask, nodes, rows, nodes2, columns):
+        '''
+        Turn a link matrix over `nodes[rows]` x `nodes2[columns]` into a list
+        of (node, node2) tuples, leaving out links of a node to itself.
+        '''
+        pairs = []
+        for i, j in zip(*np.nonzero(link_mask)):
+            node, node2 = nodes[rows[i]], nodes2[columns[j]]
+            if node is not node2:
+                pairs.append((node, node2))
+        return pairs
+
     def _increase_source_nodes(self, networkx_object):
         self.increase_length = (self._config['global']['increase-time']*60) / networkx_object.step_value
         if networkx_object.tick - self.last_increase_tick > self.increase_length:
@@ -147,33 +257,6 @@ class EdgeHandler:
         for node in networkx_object.nodes:
             node.reset_values(networkx_object)
 
-    def _is_distance_ok(self, node, node2):
-        '''TODO Documentation
-        '''
-        def distance(node1, node2):
-            a = np.array(node1.position)
-            b = np.array(node2.position)
-            return np.linalg.norm(a-b)
-
-        if node.name == 'q-stations' or node2.name == 'q-stations':
-            return True
-
-        if node.name == 'base-stations' and node2.name == 'base-stations':
-            return True
-
-        if node.name == 'base-stations' or node2.name == 'base-stations':
-            if distance(node, node2) <= 55:
-                return True
-        
-        if node.name == 'uav-base-stations' or node2.name == 'uav-base-stations':
-            if distance(node, node2) <= 45:
-                return True
-        
-        if node.name  == 'leo-satellites' or node2.name == 'leo-satellites':
-            return True
-
-        return False
-
     def set_area(self, area):
         '''TODO Documentation
         '''
@@ -183,4 +266,6 @@ class EdgeHandler:
         filepath = 'gif_images/current_' + str(self.image_count) + '.png'
         self.image_count += 1
         kwargs = {'tick_val': networkx_object.tick}
+        # Imported here, as it pulls in the plotting libraries
+        import pypoc.plotter as plotter
         plotter.save_network_graph_image(networkx_object, filepath, **kwargs)
@@ -0,0 +1,263 @@
+'''
+Array-backed storage of the links of a PyPocNetwork.
+
+PyPocNetwork is a networkx DiGraph, which keeps its edges in dicts of dicts
+keyed by Node objects. That is convenient for plotting and analysis, but every
+edge access on the per-tick paths pays for it. GraphStore keeps the same links
+with dense integer node indices and one NumPy column per edge attribute, and
+builds a CSR adjacency matrix from them when the links change. `to_networkx`
+exports the current state as a plain DiGraph.
+'''
+
+__author__ = 'Hans Hofner'
+
+import logging
+
+import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+
+class GraphStore:
+    '''
+    Links of a network as edge attribute columns.
+
+    Every link occupies a slot in the columns; slots of removed links are
+    reused. Nodes keep their index for the whole run.
+    '''
+    # Edge attribute columns and their value when a link does not set them.
+    # `Channel` defaults to 1 like a missing weight does in networkx.
+    attributes = {'Bandwidth': 0.0, 'TickValue': 0.0, 'Channel': 1.0}
+
+    def __init__(self, capacity=64):
+        self.nodes = []  # Index -> Node
+        self.index_for = {}  # Node -> index
+
+        self.source = np.zeros(capacity, dtype=np.int64)
+        self.target = np.zeros(capacity, dtype=np.int64)
+        self.columns = {name: np.zeros(capacity) for name in GraphStore.attributes}
+        # Insertion number of every slot, so rows list neighbors in the order
+        # the links were added, as networkx does
+        self._sequence = np.zeros(capacity, dtype=np.int64)
+        self._next_sequence = 0
+
+        self._slot_for = {}  # (index, index2) -> slot
+        self._free_slots = list(range(capacity - 1, -1, -1))
+        self._out_degree = np.zeros(capacity, dtype=np.int64)
+
+        self._new_slots = []  # Slots added since the last `take_new_slots`
+
+        self._slot_order = None  # Slots in CSR order
+        self._indptr = None
+        self._indices = None
+        self._in_slot_order = None  # Slots ordered by target, CSC style
+        self._in_indptr = None
+        self._successors_for = {}
+        self._matrices = {}  # (attribute, transposed) -> csr_matrix
+        # Bumped whenever an attribute changes, so cached results computed
+        # from it can tell whether they are still current
+        self.versions = dict.fromkeys(GraphStore.attributes, 0)
+
+    def __contains__(self, node):
+        return node in self.index_for
+
+    def __len__(self):
+        return len(self._slot_for)
+
+    def add_node(self, node):
+        '''
+        :return: Index of `node`, adding it if it is new.
+        '''
+        index = self.index_for.get(node)
+        if index is None:
+            index = len(self.nodes)
+            self.nodes.append(node)
+            self.index_for[node] = index
+            if index >= len(self._out_degree):
+                self._out_degree = np.concatenate((self._out_degree, np.zeros_like(self._out_degree)))
+        return index
+
+    def add_edges(self, edge_list):
+        '''
+        :param edge_list: List of (node, node2, data) tuples; attributes
+                          missing from data take their default.
+        '''
+        for node, node2, data in edge_list:
+            index, index2 = self.add_node(node), self.add_node(node2)
+            slot = self._slot_for.get((index, index2))
+            if slot is None:
+                if not self._free_slots:
+                    self._grow()
+                slot = self._free_slots.pop()
+                self._slot_for[(index, index2)] = slot
+                self.source[slot] = index
+                self.target[slot] = index2
+                self._sequence[slot] = self._next_sequence
+                self._next_sequence += 1
+                self._out_degree[index] += 1
+                self._new_slots.append(slot)
+            for name, default in GraphStore.attributes.items():
+                self.columns[name][slot] = data.get(name, default)
+        self._links_changed()
+
+    def remove_edges(self, edges):
+        '''
+        :param edges: Iterable of (node, node2) tuples.
+        '''
+        for node, node2 in edges:
+            index = self.index_for[node]
+            slot = self._slot_for.pop((index, self.index_for[node2]))
+            self._free_slots.append(slot)
+            self._out_degree[index] -= 1
+        self._links_changed()
+
+    def out_degree(self, node):
+        index = self.index_for.get(node)
+        if index is None:
+            return 0
+        return int(self._out_degree[index])
+
+    def successors(self, node):
+        '''
+        :return: List of nodes `node` links to, in the order the links were added.
+        '''
+        successors = self._successors_for.get(node)
+        if successors is None:
+            index = self.index_for.get(node)
+            if index is None:
+                return []
+            self._build_csr()
+            nodes = self.nodes
+            successors = [nodes[i] for i in self._indices[self._indptr[index]:self._indptr[index + 1]].tolist()]
+            self._successors_for[node] = successors
+        return successors
+
+    def edge_value(self, node, node2, name):
+        return self.columns[name][self._slot_for[(self.index_for[node], self.index_for[node2])]]
+
+    def weight_function(self, name, reverse=False):
+        '''
+        :param reverse: For a reversed view of the network, whose edge
+                        (node, node2) is the link (node2, node).
+        :return: networkx weight function `(node, node2, data) -> value` that
+                 reads attribute `name` of the link from the store, for running
+                 networkx algorithms on the network with the current values.
+                 Valid until links are added.
+        '''
+        column = self.columns[name]
+        slot_for = self._slot_for
+        index_for = self.index_for
+
+        if reverse:
+            return lambda node, node2, data: column[slot_for[(index_for[node2], index_for[node])]].item()
+        return lambda node, node2, data: column[slot_for[(index_for[node], index_for[node2])]].item()
+
+    def set_values(self, name, slots, values):
+        '''
+        Set attribute `name` of the links in `slots`.
+        '''
+        self.columns[name][slots] = values
+        self._attribute_changed(name)
+
+    def incident_slots(self, indices):
+        '''
+        :param indices: Node indices.
+        :return: Array of the slots of all links from or to those nodes. Links
+                 between two of them are listed twice.
+        '''
+        self._build_csr()
+        if not indices:
+            return np.zeros(0, dtype=np.int64)
+        indptr, in_indptr = self._indptr, self._in_indptr
+        return np.concatenate([self._slot_order[indptr[i]:indptr[i + 1]] for i in indices] +
+                              [self._in_slot_order[in_indptr[i]:in_indptr[i + 1]] for i in indices])
+
+    def take_new_slots(self):
+        '''
+        :return: Array of the slots of links added since the last call, that
+                 are still in use.
+        '''
+        slots = [slot for slot in self._new_slots
+                 if self._slot_for.get((int(self.source[slot]), int(self.target[slot]))) == slot]
+        self._new_slots.clear()
+        return np.array(slots, dtype=np.int64)
+
+    def slots(self):
+        '''
+        :return: Array of the slots in use, in CSR order.
+        '''
+        self._build_csr()
+        return self._slot_order
+
+    def matrix(self, name, transposed=False):
+        '''
+        Adjacency matrix weighted by attribute `name`. Explicit zeros are kept,
+        which scipy.sparse.csgraph treats as zero-weight links.
+
+        :param transposed: Return the matrix of the reversed graph.
+        :return: scipy.sparse.csr_matrix of shape (n, n), n the number of nodes.
+        '''
+        matrix = self._matrices.get((name, transposed))
+        if matrix is None:
+            self._build_csr()
+            size = len(self.nodes)
+            matrix = csr_matrix((self.columns[name][self._slot_order], self._indices, self._indptr),
+                                shape=(size, size))
+            if transposed:
+                matrix = matrix.transpose().tocsr()
+            self._matrices[(name, transposed)] = matrix
+        return matrix
+
+    def to_networkx(self, nodes=None):
+        '''
+        :param nodes: Nodes to include, in this order, on top of those with
+                      links. Defaults to the nodes of the store.
+        :return: nx.DiGraph with the current links and their attributes.
+        '''
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.nodes if nodes is None else nodes)
+        slots = self.slots()
+        nodes = self.nodes
+        columns = {name: column[slots].tolist() for name, column in self.columns.items()}
+        for k, (index, index2) in enumerate(zip(self.source[slots].tolist(), self.target[slots].tolist())):
+            graph.add_edge(nodes[index], nodes[index2], **{name: column[k] for name, column in columns.items()})
+        return graph
+
+    def _grow(self):
+        capacity = len(self.source)
+        self.source = np.concatenate((self.source, np.zeros_like(self.source)))
+        self.target = np.concatenate((self.target, np.zeros_like(self.target)))
+        self._sequence = np.concatenate((self._sequence, np.zeros_like(self._sequence)))
+        for name in self.columns:
+            self.columns[name] = np.concatenate((self.columns[name], np.zeros_like(self.columns[name])))
+        self._free_slots.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def _build_csr(self):
+        if self._slot_order is not None:
+            return
+        slots = np.fromiter(self._slot_for.values(), dtype=np.int64, count=len(self._slot_for))
+        slots = slots[np.lexsort((self._sequence[slots], self.source[slots]))]
+        self._slot_order = slots
+        self._indices = self.target[slots]
+        self._indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(self._out_degree[:len(self.nodes)], out=self._indptr[1:])
+
+        self._in_slot_order = slots[np.argsort(self.target[slots], kind='stable')]
+        self._in_indptr = np.zeros(len(self.nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.target[slots], minlength=len(self.nodes)), out=self._in_indptr[1:])
+
+    def _links_changed(self):
+        self._slot_order = None
+        self._successors_for.clear()
+        self._matrices.clear()
+
+    def _attribute_changed(self, name):
+        self.versions[name] += 1
+        for key in [key for key in self._matrices if key[0] == name]:
+            del self._matrices[key]
+
+    def __repr__(self):
+        return f'GraphStore(nodes:{len(self.nodes)}, links:{len(self._slot_for)})'
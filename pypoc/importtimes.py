@@ -0,0 +1,68 @@
+'''
+Import time of the subsystems of PyPoc.
+
+Running the simulation only needs the simulation core; the plotting
+libraries (matplotlib, seaborn, pandas) and the machine learning stack
+(torch, torchvision) are imported by the modules that use them, when they are
+used. `measure` imports every subsystem in a fresh interpreter and reports how
+long it took and which of those heavy libraries came along, so that an
+import that slows down every run shows up:
+
+    python -m pypoc --import-times
+'''
+
+__author__ = 'Hans Hofner'
+
+import json
+import logging
+import subprocess
+import sys
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+# Subsystem -> module that is imported for it
+SUBSYSTEMS = {'results': 'pypoc.reader',
+              'simulation': 'pypoc.network',
+              'python api': 'pypoc.simulation',
+              'sweeps': 'pypoc.sweep',
+              'plotting': 'pypoc.plotter',
+              'q-learning': 'pypoc.qnode'}
+
+# Libraries that take long to import
+HEAVY_MODULES = ('torch', 'torchvision', 'matplotlib', 'seaborn', 'pandas', 'sklearn', 'scipy')
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def measure_module(module):
+    '''
+    :return: Dict of the 'seconds' importing `module` took in a fresh
+             interpreter and the 'heavy' HEAVY_MODULES it imported.
+    '''
+    output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(subsystems=None):
+    '''
+    :param subsystems: Names of SUBSYSTEMS to measure; None for all.
+    :return: Dict of subsystem -> measure_module dict.
+    '''
+    return {name: measure_module(SUBSYSTEMS[name]) for name in (subsystems or SUBSYSTEMS)}
+
+
+def print_report(times):
+    '''
+    Print the import times of `measure` as a table.
+    '''
+    print(f'{"subsystem":<12} {"module":<18} {"seconds":>8}  heavy imports')
+    for name, measured in times.items():
+        print(f'{name:<12} {SUBSYSTEMS[name]:<18} {measured["seconds"]:>8.2f}  {", ".join(measured["heavy"]) or "-"}')
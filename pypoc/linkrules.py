@@ -0,0 +1,110 @@
+'''
+Distance rules deciding which nodes can link to each other.
+
+Both the Topology (initial links) and the EdgeHandler (links during the
+simulation) decide links from node class and distance. The rules are kept here
+so both evaluate them the same way: every pair of node classes resolves to a
+link radius, and a whole class pair is evaluated at once as a boolean matrix
+over the positions of the two classes.
+'''
+
+__author__ = 'Hans Hofner'
+
+import math
+import logging
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+# Above this many pairs, distances are found with a KD-tree instead of a
+# dense distance matrix
+DENSE_PAIR_LIMIT = 250_000
+
+
+class LinkRules:
+    def __init__(self, link_range_for, any_distance_classes=(), any_distance_pairs=()):
+        '''
+        :param link_range_for: Dict of node class -> distance in meters within
+                               which it links to other nodes.
+        :param any_distance_classes: Node classes that link at any distance.
+        :param any_distance_pairs: (class, class) tuples that link at any distance.
+        '''
+        self.link_range_for = dict(link_range_for)
+        self.any_distance_classes = set(any_distance_classes)
+        self.any_distance_pairs = set(any_distance_pairs)
+
+    def link_radius(self, name, name2):
+        '''
+        Largest distance at which nodes of classes `name` and `name2` link.
+
+        :return: Float in meters, math.inf for any distance, or None if the
+                 two classes never link.
+        '''
+        if (name in self.any_distance_classes or name2 in self.any_distance_classes
+                or (name, name2) in self.any_distance_pairs):
+            return math.inf
+        ranges = [self.link_range_for[n] for n in (name, name2) if n in self.link_range_for]
+        if not ranges:
+            return None
+        return max(ranges)
+
+    def link_matrix(self, name, positions, name2, positions2, same_nodes=False):
+        '''
+        Evaluate the rules for every pair of two node classes at once.
+
+        :param name: Node class of the rows.
+        :param positions: (n, 3) array of positions of the row nodes.
+        :param name2: Node class of the columns.
+        :param positions2: (n2, 3) array of positions of the column nodes.
+        :param same_nodes: True if rows and columns are the same nodes, in the
+                           same order; a node never links to itself.
+        :return: (n, n2) boolean array, True where row node i may link to column
+                 node j.
+        '''
+        radius = self.link_radius(name, name2)
+        shape = (len(positions), len(positions2))
+        if radius is None:
+            return np.zeros(shape, dtype=bool)
+
+        if radius == math.inf:
+            mask = np.ones(shape, dtype=bool)
+        elif shape[0] * shape[1] <= DENSE_PAIR_LIMIT:
+            difference = positions[:, np.newaxis, :] - positions2[np.newaxis, :, :]
+            mask = np.einsum('ijk,ijk->ij', difference, difference) <= radius**2
+        else:
+            mask = np.zeros(shape, dtype=bool)
+            neighbors = cKDTree(positions2).query_ball_point(positions, radius)
+            for i, near in enumerate(neighbors):
+                mask[i, near] = True
+
+        if same_nodes:
+            np.fill_diagonal(mask, False)
+        return mask
+
+    def __repr__(self):
+        return (f'LinkRules(ranges:{self.link_range_for}, any_distance:{self.any_distance_classes}, '
+                f'any_distance_pairs:{self.any_distance_pairs})')
+
+
+def positions_of(nodes):
+    '''
+    :return: (len(nodes), 3) float array of node positions.
+    '''
+    return np.array([node.position for node in nodes], dtype=float).reshape(len(nodes), 3)
+
+
+# Rules used to build the initial topology
+TOPOLOGY_RULES = LinkRules(link_range_for={'base-stations': 55,
+                                           'uav-base-stations': 50,
+                                           'leo-satellites': 2000},
+                           any_distance_classes={'q-stations'},
+                           any_distance_pairs={('base-stations', 'base-stations')})
+
+# Rules used by the EdgeHandler when refreshing links during the simulation
+REFRESH_RULES = LinkRules(link_range_for={'base-stations': 55,
+                                          'uav-base-stations': 45},
+                          any_distance_classes={'q-stations', 'leo-satellites'},
+                          any_distance_pairs={('base-stations', 'base-stations')})
@@ -1,8 +1,6 @@
 ''' Defines mobility models (generator methods)
 '''
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.preprocessing import normalize
 
 from enum import Enum
 from collections import namedtuple
@@ -16,21 +16,22 @@ import time
 import csv
 import os
 from copy import copy
+from collections import Counter
 from datetime import datetime, timedelta
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
 import networkx as nx
-import seaborn as sns
-import pandas as pd
 import numpy as np
-import toml
 from tqdm import tqdm # Progress Bar
-from scipy.spatial import distance
 from pypoc.edgehandler import EdgeHandler
+from pypoc.scheduler import EventScheduler
+from pypoc.graphstore import GraphStore
+from pypoc.packetarena import PacketArena, PacketRef
+from pypoc.results import ResultsWriter, MemoryResults, PacketRecords, csv_packet_rows, write_summary
+from pypoc.delaystats import DelayStats
+import pypoc.telemetry as telemetry
+from pypoc.routing import ROUTING_METHODS
 from pypoc.topology import Topology
 from pypoc.node import Packet, Node, VaryingTransmitNode, VaryingRelayNode, MovingNode, RestrictedNode
-from pypoc.qnode import QNode
 
 logging.basicConfig(level=logging.ERROR)
 LOGGER = logging.getLogger(__name__)
@@ -80,13 +81,14 @@ class NetworkData:
         '''
         Save all metadata to file, as well as all nodes data.
         :param network: PyPocNetwork object
-        :return None:
+        :param filename: Name of the file in ./output_data/, or a path of it.
+        :return: Path of the file written.
         '''
         if filename is None:
             filename = f'{self.title}_{self.data["start_time_value"].strftime("%d%b%y_%H_%M_%S")}.csv'
 
         if data_filepath is None:
-            data_filepath = f'./output_data/' + filename
+            data_filepath = filename if os.path.dirname(filename) else f'./output_data/' + filename
 
         with open(data_filepath, mode='w') as csvfile:
             writer = csv.writer(csvfile, dialect='excel')
@@ -97,12 +99,20 @@ class NetworkData:
                     writer.writerow([key] + self.data[key])
                 else:
                     writer.writerow([key] + [self.data[key]])
+            records = network.packet_records
+            writer.writerows(csv_packet_rows(records.records(), records.paths,
+                                             {node.id: str(node) for node in network.nodes}))
+        return data_filepath
 
 
 class PyPocNetwork(nx.DiGraph):
     '''
     PyPocNetwork object that manages
     '''
+    valid_engines = {'tick', 'event'}
+    valid_packet_stores = {'objects', 'arena'}
+    valid_output_formats = {'pypoc', 'csv', 'memory'}
+
     def initialize(self, configuration):
         self.meta = NetworkData()  # for a fun naming thing; ie self.meta.data hehe
 
@@ -115,38 +125,135 @@ class PyPocNetwork(nx.DiGraph):
         self.meta.area = (configuration['area']['width'], configuration['area']['height'])
 
         self.edge_handler = EdgeHandler(configuration)
+        routing = configuration['global'].get('routing', 'shortest-path')
+        if routing not in ROUTING_METHODS:
+            raise Exception(f'Incorrect routing {routing}; '
+                            f'must be one of {set(ROUTING_METHODS)}')
+        self.routes = ROUTING_METHODS[routing](self, configuration['global'].get('route-cache-ticks', 0),
+                                               configuration['global'].get('routing-backend', 'networkx'))
+
+        packet_store = configuration['global'].get('packet-store', 'objects')
+        if packet_store not in PyPocNetwork.valid_packet_stores:
+            raise Exception(f'Incorrect packet store {packet_store}; '
+                            f'must be one of {PyPocNetwork.valid_packet_stores}')
+        # Nodes create their packets through `new_packet`
+        if packet_store == 'arena':
+            self.packet_arena = PacketArena()
+            self.packet_arena.add_hop_table(self.routes)
+            PacketRef.arena = self.packet_arena
+            self.new_packet = self.packet_arena.new
+        else:
+            self.packet_arena = None
+            self.new_packet = Packet
+
+        # Packets add their record and their delay here when they arrive or
+        # are dropped; without the packet table only the delays are kept
+        self.packet_table = configuration['global'].get('packet-table', True)
+        self.delay_stats = DelayStats()
+        self.packet_records = PacketRecords(stats=self.delay_stats, table=self.packet_table)
+        Packet.records = self.packet_records
 
         self.wanting_states = []
 
+        # Results are written as a results file, streamed every `flush_ticks`
+        # ticks (0: at the end), as one CSV file at the end, or kept in memory
+        # ("memory"); see `open_results`
+        self.output_format = configuration['global'].get('output-format', 'pypoc')
+        if self.output_format not in PyPocNetwork.valid_output_formats:
+            raise Exception(f'Incorrect output format {self.output_format}; '
+                            f'must be one of {PyPocNetwork.valid_output_formats}')
+        self.flush_ticks = configuration['global'].get('flush-ticks', 1000)
+        if self.flush_ticks < 0:
+            raise Exception(f'Incorrect flush-ticks {self.flush_ticks}; must be 0 or more')
+        self.results = None
+        # Sum and length of the throughput list entries already flushed
+        self._flushed_throughput = (0.0, 0)
+
+        # Only set while running with the event engine
+        self.scheduler = None
+
     def initialize_step_values(self):
         '''
         This method defines the step value for the
         network based on bandwidth and packet size, and then
-        updates the value for all nodes.
+        updates the value for all nodes. It also sets up the link
+        tables of every node and the graph store; from then on `add_links`
+        and `remove_links` keep all of them up to date.
         '''
-        highest_bandwidth = None
+        self._bandwidth_counts = Counter()  # Bandwidth -> number of links with it
         for edge in self.edges.data():
             try:
                 bandwidth = edge[2]['Bandwidth']
             except KeyError:
                 LOGGER.error(f'Could not find Bandwidth edge attribute for edge {edge}')
             else:
-                if highest_bandwidth is None:
-                    highest_bandwidth = edge[2]['Bandwidth']
-                elif edge[2]['Bandwidth'] > highest_bandwidth:
-                    highest_bandwidth = edge[2]['Bandwidth']
+                self._bandwidth_counts[bandwidth] += 1
 
-                # print(f'Setting Tick Value for edge {edge}')
-                # print(f'Previous: {edge[2]["TickValue"]}')
                 # Set the edges bandwidth value
-                edge[2]['TickValue'] = self.packet_size/edge[2]['Bandwidth']
-                # input(f'After: {edge[2]["TickValue"]}')
+                edge[2]['TickValue'] = self.packet_size/bandwidth
+                edge[0].link_added(edge[1], edge[2]['TickValue'])
 
-        self.step_value = self.packet_size/highest_bandwidth
-        for node in self.nodes:
-            node.step_value = self.step_value
+        # Array copy of the links used on the per-tick paths
+        self.graph_store = GraphStore()
+        self.graph_store.add_edges(list(self.edges.data()))
+        self._queue_lengths = np.zeros(0)  # Per store index, as of the last channel update
+
+        self.step_value = None
+        self._update_step_value()
+
+    def _update_step_value(self):
+        step_value = self.packet_size/max(self._bandwidth_counts)
+        if step_value != self.step_value:
+            self.step_value = step_value
+            for node in self.nodes:
+                node.step_value = self.step_value
+
+            self.meta.data['step_value'] = self.step_value
 
-        self.meta.data['step_value'] = self.step_value
+    def add_links(self, edge_list):
+        '''
+        Add links to the network and to the link tables of their nodes.
+
+        :param edge_list: List of (node, node2, data) tuples; data needs a
+                          `Bandwidth`, its `TickValue` is filled in here.
+        '''
+        if not edge_list:
+            return
+        for node, node2, data in edge_list:
+            bandwidth = data['Bandwidth']
+            data['TickValue'] = self.packet_size/bandwidth
+            self._bandwidth_counts[bandwidth] += 1
+        self.graph_store.add_edges(edge_list)
+        for node, node2, data in edge_list:
+            # The current Channel is only kept in the graph store
+            data.pop('Channel', None)
+        self.add_edges_from(edge_list)
+        for node, node2, data in edge_list:
+            # Nodes added during the run start with a step value of 0
+            node.step_value = node2.step_value = self.step_value
+            node.link_added(node2, data['TickValue'])
+        self._update_step_value()
+        self.routes.invalidate()
+
+    def remove_links(self, edges):
+        '''
+        Remove links from the network and from the link tables of their nodes.
+
+        :param edges: Iterable of (node, node2) tuples.
+        '''
+        edges = list(edges)
+        if not edges:
+            return
+        for node, node2 in edges:
+            bandwidth = self[node][node2]['Bandwidth']
+            self._bandwidth_counts[bandwidth] -= 1
+            if not self._bandwidth_counts[bandwidth]:
+                del self._bandwidth_counts[bandwidth]
+            node.link_removed(node2)
+        self.graph_store.remove_edges(edges)
+        self.remove_edges_from(edges)
+        self._update_step_value()
+        self.routes.invalidate()
 
     def update_throughput(self):
         try:
@@ -165,13 +272,25 @@ class PyPocNetwork(nx.DiGraph):
         self.meta.data['drop_rate_value'] = overall_drop_rate
 
     def get(self, key, node1, node2):
-        return self[node1][node2][str(key)]
+        return self.graph_store.edge_value(node1, node2, str(key))
+
+    def to_networkx(self):
+        '''
+        :return: nx.DiGraph copy of the network with the current edge
+                 attributes, for plotting and analysis.
+        '''
+        return self.graph_store.to_networkx(nodes=self.nodes)
 
     def update_byte_count(self, packet):
         self.meta.data['total_byte_count_value'] += packet.size
 
     def reset(self):
+        '''
+        Reset the packet counters and node ids, which are kept class-wide, so
+        that a run does not depend on runs before it in the same process.
+        '''
         Packet.reset()
+        Node.count = 0
 
     def get_count_of(self, type_of_node):
         count = 0
@@ -194,26 +313,14 @@ class PyPocNetwork(nx.DiGraph):
         '''
         print('Collecting node data...')
         for node in self.nodes:
-            for key in node.data.keys():
-                self.meta.data[f'{node}_{key}'] = node.data[key]
+            for key, values in node.data.export().items():
+                self.meta.data[f'{node}_{key}'] = values
 
     def collect_packet_data(self):
         '''
-        Iterate through all packets (dropped ones, too) and collect their data into file.
+        Collect the packet counts. The data of every packet is in the packet
+        table, `packet_records`.
         '''
-        # In theory, there should be no double reference to the same packet...
-        for node in self.nodes:
-            for dropped_packet in node.data['dropped_packets']:
-                self.meta.data[f'{dropped_packet}_path'] = dropped_packet.path_nodes['past']
-                self.meta.data[f'{dropped_packet}_born_tick'] = dropped_packet.born_tick
-                self.meta.data[f'{dropped_packet}_died_tick'] = dropped_packet.died_tick
-            if node.node_type is 2:
-                for packet in node.queue:
-                    # Path taken by Packet
-                    self.meta.data[f'{packet}_path'] = packet.path_nodes['past']
-                    self.meta.data[f'{packet}_born_tick'] = packet.born_tick
-                    self.meta.data[f'{packet}_died_tick'] = packet.died_tick
-
         self.meta.data['packet_drop_value'] = Packet.dropped_count
         self.meta.data['packet_arrive_value'] = Packet.arrived_count
         self.meta.data['packet_generated_value'] = Packet.generated_count
@@ -221,11 +328,179 @@ class PyPocNetwork(nx.DiGraph):
     def collect_node_count(self):
         self.meta.data['node_count_list'].append(len(self.nodes))
 
+    ###################################################################################################
+    # Streaming Results ###############################################################################
+    ###################################################################################################
+    # Per-tick lists of NetworkData that are streamed instead of kept
+    streamed_lists = ('throughput_list', 'drop_rate_list', 'node_count_list')
+    # Keys of NetworkData that describe the run rather than its results
+    metadata_keys = ('step_value', 'start_time_value', 'end_time_value')
+
+    def open_results(self, configuration, filename=None):
+        '''
+        Start writing the results file of the run next to `filename`, or
+        collecting the results in memory for the "memory" output format;
+        nothing for "csv".
+
+        :param filename: Path of the data file of the run; its extension is
+                         replaced by that of the results file.
+        '''
+        if self.output_format == 'csv':
+            return
+        if self.output_format == 'memory':
+            self.results = MemoryResults()
+        else:
+            if filename is None:
+                filename = f'./output_data/{self.meta.title}_{datetime.now().strftime("%d%b%y_%H_%M_%S")}'
+            self.results = ResultsWriter(os.path.splitext(filename)[0] + ResultsWriter.extension)
+        self._configuration = configuration
+        self._next_flush_tick = self.flush_ticks or float('inf')
+
+    def flush_results(self, force=False):
+        '''
+        Move the per-tick data and packet records collected since the last
+        flush into the results file, once every `flush_ticks` ticks.
+
+        :param force: Flush now, whatever the tick.
+        '''
+        if self.results is None or (self.tick < self._next_flush_tick and not force):
+            return
+        if self.flush_ticks:
+            self._next_flush_tick = (self.tick // self.flush_ticks + 1) * self.flush_ticks
+
+        results = self.results
+        total, ticks = self._flushed_throughput
+        throughput = self.meta.data['throughput_list']
+        self._flushed_throughput = (total + sum(throughput), ticks + len(throughput))
+        for key in PyPocNetwork.streamed_lists:
+            results.append(f'network/{key}', self.meta.data[key])
+            self.meta.data[key].clear()
+        for node in self.nodes:
+            for key in node.data.keys():
+                metric = node.data[key]
+                if self._is_streamed(key, metric):
+                    results.append(f'nodes/{node}/{key}', self._metric_values(key, metric.take()))
+
+        if self.packet_table:
+            packets, paths = self.packet_records.take()
+            results.append('packets', packets)
+            results.append('paths/nodes', [node_id for path in paths for node_id in path])
+            results.append('paths/lengths', [len(path) for path in paths])
+        results.flush()
+
+    def finish_results(self):
+        '''
+        Flush the rest of the data, write the metadata and summary values of
+        the run into the footer and close the results file.
+        '''
+        self.flush_results(force=True)
+
+        summary = {}
+        for node in self.nodes:
+            for key in node.data.keys():
+                metric = node.data[key]
+                name = f'nodes/{node}/{key}'
+                if metric.retention == 'count':
+                    summary[f'{node}_{key}'] = metric.count
+                elif metric.retention == 'none' or self._is_streamed(key, metric):
+                    continue
+                elif len(metric):
+                    values = metric.values() if hasattr(metric, 'fill') else list(metric)
+                    try:
+                        self.results.append(name, self._metric_values(key, values))
+                    except (TypeError, ValueError):
+                        LOGGER.warning(f'Not writing {name}; it is not numeric')
+
+        for name, counts in self.delay_stats.arrays().items():
+            self.results.append(name, counts)
+
+        self.collect_packet_data()
+        summary.update((key, value) for key, value in self.meta.data.items()
+                       if not isinstance(value, list) and key not in PyPocNetwork.metadata_keys)
+        summary.update(self.delay_stats.summary())
+        self.results.close(self._metadata(), summary)
+        if self.results.filepath is not None:
+            print(f'Results written to {self.results.filepath}')
+
+    def _metadata(self):
+        '''
+        :return: Dict describing the run, for the results file.
+        '''
+        metadata = {'title': self.meta.title,
+                    'author': self.meta.author,
+                    'ticks': self.tick,
+                    'configuration': self._configuration,
+                    'nodes': [{'node': str(node), 'id': node.id, 'class': node.name, 'type': node.node_type}
+                              for node in self.nodes]}
+        metadata.update((key, self.meta.data[key]) for key in PyPocNetwork.metadata_keys)
+        return metadata
+
+    # Values of NetworkData in the summary file of a run
+    summary_keys = ('throughput_value', 'drop_rate_value', 'packet_drop_value',
+                    'packet_arrive_value', 'packet_generated_value', 'step_value')
+
+    def run_summary(self):
+        '''
+        :return: Dict of the summary values of the run, for its summary file:
+                 `summary_keys`, the mean of the throughput list and the
+                 delay statistics (see DelayStats.summary), in ticks.
+        '''
+        summary = {key: self.meta.data[key] for key in PyPocNetwork.summary_keys}
+        summary['title'] = self.meta.title
+        summary['ticks'] = self.tick
+        total, ticks = self._flushed_throughput
+        throughput = self.meta.data['throughput_list']
+        ticks += len(throughput)
+        summary['throughput_mean'] = (total + sum(throughput)) / ticks if ticks else None
+        summary.update(self.delay_stats.summary())
+        return summary
+
+    @staticmethod
+    def _is_streamed(key, metric):
+        '''
+        :return: True if `flush_results` streams the metric: per-tick series
+                 and packet logs that retain everything.
+        '''
+        return metric.retention == 'all' and (hasattr(metric, 'fill') or key.endswith('_packets'))
+
+    @staticmethod
+    def _metric_values(key, values):
+        '''
+        :return: `values` of a metric as written to the results file; packet
+                 logs are written as packet ids.
+        '''
+        if key.endswith('_packets'):
+            return np.array([packet.id for packet in values], dtype=np.int64)
+        return values
+
     # TODO: This needs to be addressed...perhaps in EdgeHandler?
-    def update_channel_loads(self):
-        for edge in self.edges:
-            n1, n2 = edge
-            self[n1][n2]['Channel'] = len(n1.queue) + len(n2.queue)
+    def update_channel_loads(self, nodes=None):
+        '''
+        Set the `Channel` weight of every link to the summed queue lengths of
+        its two nodes. Only the links of nodes whose queue length changed since
+        the last update, and links added since then, are written.
+
+        :param nodes: Nodes that may have changed their queue since the last
+                      update, i.e. the nodes that ran. Defaults to all nodes.
+        '''
+        store = self.graph_store
+        queue_lengths = self._queue_lengths
+        if len(queue_lengths) < len(store.nodes):
+            queue_lengths = np.concatenate((queue_lengths, np.zeros(len(store.nodes) - len(queue_lengths))))
+            self._queue_lengths = queue_lengths
+
+        changed = []
+        index_for = store.index_for
+        for node in store.nodes if nodes is None else nodes:
+            index = index_for.get(node)
+            if index is not None and len(node.queue) != queue_lengths[index]:
+                queue_lengths[index] = len(node.queue)
+                changed.append(index)
+
+        slots = np.concatenate((store.incident_slots(changed), store.take_new_slots()))
+        if slots.size:
+            store.set_values('Channel', slots,
+                             queue_lengths[store.source[slots]] + queue_lengths[store.target[slots]])
 
     def request_state(self, node, memory_set):
         '''
@@ -252,49 +527,201 @@ class PyPocNetwork(nx.DiGraph):
 
         self.wanting_states.clear()
 
+    def activate(self, node):
+        '''
+        Called when `node` gets new work (i.e. receives a packet). When idle nodes
+        are skipped, the node joins the active set: it runs later this tick if it
+        comes after the currently running node, or on the next tick otherwise --
+        the same tick it would have handled the packet on when every node runs.
+        '''
+        if self.scheduler is None:
+            return
+        order = self._node_order[node]
+        tick = self.tick if order > self._current_order else self.tick + 1
+        self.scheduler.schedule_node(node, tick, order)
+
+    def _start_scheduler(self):
+        self.scheduler = EventScheduler()
+        self._node_order = {}
+        self._current_order = -1
+        self._register_new_nodes()
+
+    def _register_new_nodes(self):
+        '''
+        Give every node not yet known to the scheduler an order and schedule it
+        on the next tick.
+        '''
+        for node in self.nodes:
+            if node not in self._node_order:
+                self._node_order[node] = len(self._node_order)
+                self.scheduler.schedule_node(node, self.tick + 1, self._node_order[node])
+
+    def _run_active_nodes(self):
+        '''
+        Run the nodes scheduled for the current tick, in network order, and
+        reschedule each one at its next active tick. Nodes with nothing left to
+        do drop out until `activate` is called on them; mobile nodes run on
+        every tick, as they move on every tick.
+
+        :return: List of the nodes that ran.
+        '''
+        tick = self.tick
+        ran_nodes = []
+        while self.scheduler.peek() == (tick, EventScheduler.NODE):
+            _, self._current_order, _, node = self.scheduler.pop()
+            node.catch_up_data(tick)
+            node.run(self)
+            ran_nodes.append(node)
+            next_tick = self.tick + 1 if node.is_mobile else node.next_active_tick(self)
+            if next_tick is not None:
+                self.scheduler.schedule_node(node, next_tick, self._current_order)
+        self._current_order = -1
+        return ran_nodes
+
+    def _fill_idle_ticks(self, next_tick):
+        '''
+        Record the network-wide per-tick values for the ticks between the last
+        processed tick and `next_tick`, on which no event fired.
+        '''
+        idle_ticks = range(self.tick + 1, next_tick)
+        if not idle_ticks:
+            return
+        total_bytes = self.meta.data['total_byte_count_value']
+        step_value = self.meta.data['step_value']
+        self.meta.data['node_count_list'].extend([len(self.nodes)] * len(idle_ticks))
+        self.meta.data['throughput_list'].extend(total_bytes / (t * step_value) for t in idle_ticks)
+        self.meta.data['throughput_value'] = self.meta.data['throughput_list'][-1]
+        self.meta.data['drop_rate_list'].extend([self.meta.data['drop_rate_value']] * len(idle_ticks))
+
+    def _reschedule_after_refresh(self):
+        '''
+        Refreshing the edges resets the link-free ticks of every node and may add
+        nodes, so new nodes and every node with queued packets run next tick.
+        '''
+        self._register_new_nodes()
+        for node in self.nodes:
+            if node.queue and node.node_type != 2:
+                self.scheduler.schedule_node(node, self.tick + 1, self._node_order[node])
+
+    def _finish_active_nodes(self, ticks):
+        for node in self.nodes:
+            node.catch_up_data(ticks + 1)
+
     def preview(self):
         LOGGER.debug("Running network with these parameters")
         LOGGER.debug(f"Node count: {len(self.nodes)}")
         for node in self.nodes:
             LOGGER.debug(f'Node: {node} -- Type:{type(node)}')
 
-        time.sleep(5)
     ###################################################################################################
     # Main Loop #######################################################################################
     ###################################################################################################
-    def run_main_loop(self, minutes, **kwargs):
+    def run_main_loop(self, minutes, skip_idle_nodes=False, **kwargs):
         self.preview()
         seconds = minutes * 60
         ticks = int(seconds / self.step_value)
         #answer = input(f'Please confirm run. {ticks} ticks, ok? ([y]/n) ')
         #if answer == 'n':
         #    print('Did not run'); return
+        self.tick = 0
+        if skip_idle_nodes:
+            self._start_scheduler()
         self.meta.data['start_time_value'] = datetime.now()
         LOGGER.debug(f'~~~~ Running {self.meta.title} for {ticks} time steps ~~~~')
         for self.tick in tqdm(range(1, ticks+1)):
             self.collect_node_count()
             # print(f'\n~~~~ TIME {self.tick} ~~~~\n')
-            for node in self.nodes:
-                # print(f'---->: {node} :<----')
-                node.run(self)
+            if skip_idle_nodes:
+                ran_nodes = self._run_active_nodes()
+            else:
+                ran_nodes = None
+                for node in self.nodes:
+                    # print(f'---->: {node} :<----')
+                    node.run(self)
 
-            self.update_channel_loads()
+            self.update_channel_loads(ran_nodes)
             self.update_throughput()
             self.update_drop_rate()
-            self.edge_handler.handle_edges(self)
+            if self.edge_handler.handle_edges(self) and skip_idle_nodes:
+                self._reschedule_after_refresh()
             self._record_states()
+            self.flush_results()
             # print(f'Tick {self.tick}')
             # for edge in self.edges.data():
             #     print(edge)
             # input(',...')
 
-        if 'filename' in kwargs.keys():
-            simulation_filename = kwargs['filename']
+        if skip_idle_nodes:
+            self._finish_active_nodes(ticks)
+        self.finish_run(**kwargs)
+
+    def run_event_loop(self, minutes, **kwargs):
+        '''
+        Discrete event version of `run_main_loop`. Nodes are only run at the
+        ticks returned by their `next_active_tick` or when they receive a
+        packet, and topology refreshes are scheduled as events, so the cost
+        grows with the number of events instead of ticks x nodes. Mobile nodes
+        run on every tick, so this only saves time on static nodes; the
+        results are those of `run_main_loop`.
+        '''
+        self.preview()
+        seconds = minutes * 60
+        ticks = int(seconds / self.step_value)
+
+        self.tick = 0
+        self._start_scheduler()
+        self.scheduler.schedule(self.edge_handler.next_refresh_tick(self.tick), EventScheduler.TOPOLOGY)
+
+        self.meta.data['start_time_value'] = datetime.now()
+        LOGGER.debug(f'~~~~ Running {self.meta.title} for {ticks} time steps (event engine) ~~~~')
+        progress = tqdm(total=ticks)
+        while self.scheduler:
+            tick, _ = self.scheduler.peek()
+            if tick > ticks:
+                break
+            self._fill_idle_ticks(tick)
+            progress.update(tick - self.tick)
+            self.tick = tick
+            self.collect_node_count()
+
+            ran_nodes = self._run_active_nodes()
+
+            self.update_channel_loads(ran_nodes)
+            self.update_throughput()
+            self.update_drop_rate()
+            if self.scheduler.peek() == (tick, EventScheduler.TOPOLOGY):
+                self.scheduler.pop()
+                if self.edge_handler.handle_edges(self):
+                    self._reschedule_after_refresh()
+                self.scheduler.schedule(self.edge_handler.next_refresh_tick(tick), EventScheduler.TOPOLOGY)
+            self._record_states()
+            self.flush_results()
+
+        self._fill_idle_ticks(ticks + 1)
+        progress.update(ticks - self.tick)
+        progress.close()
+        self.tick = ticks
+        self._finish_active_nodes(ticks)
+
+        self.finish_run(**kwargs)
+
+    def finish_run(self, **kwargs):
+        '''
+        Collect node and packet data, save it to file and print a summary.
+        '''
         # Postprocessing methods here #
         self.meta.data['end_time_value'] = datetime.now()
-        self.collect_node_data()
-        self.collect_packet_data()
-        self.meta.data_save_to_file(self, simulation_filename)
+        if self.results is None:
+            self.collect_node_data()
+            self.collect_packet_data()
+            filepath = self.meta.data_save_to_file(self, kwargs.get('filename'))
+        else:
+            self.finish_results()
+            filepath = self.results.filepath
+        # Path of the run file written, None if the results are kept in memory
+        self.run_filepath = filepath
+        if filepath is not None:
+            write_summary(filepath, self.run_summary())
 
         print(f'########### FINISH ###########')
         print(f'\tGENERATED PACKETS: {Packet.generated_count}')
@@ -314,33 +741,45 @@ class PyPocNetwork(nx.DiGraph):
 
         '''
 
+        self.reset()
+        seed = configuration['global'].get('seed')
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+
+        # Nodes pick up the telemetry settings when they are created
+        telemetry.configure(configuration.get('telemetry'))
+
         # Get edge structure
         new = Topology(configuration)
         self.add_edges_from(new.topology)
 
         self.initialize(configuration)
+        self.open_results(configuration, kwargs.get('filename'))
+
+        # pypoc.profiler.Profiler timing the phases of the run, if any
+        profiler = kwargs.pop('profiler', None)
+        if profiler is not None:
+            profiler.instrument(self)
+            profiler.start()
+
+        engine = configuration['global'].get('engine', 'tick')
+        if engine not in PyPocNetwork.valid_engines:
+            raise Exception(f'Incorrect engine {engine}; '
+                            f'must be one of {PyPocNetwork.valid_engines}')
 
         # Get minutes
         minutes = configuration['global']['minutes']
         try:
-            self.run_main_loop(minutes, **kwargs)
+            if engine == 'event':
+                self.run_event_loop(minutes, **kwargs)
+            else:
+                skip_idle_nodes = configuration['global'].get('skip-idle-nodes', True)
+                self.run_main_loop(minutes, skip_idle_nodes=skip_idle_nodes, **kwargs)
         except KeyboardInterrupt:
-            if 'filename' in kwargs.keys():
-                simulation_filename = kwargs['filename']
-            # Postprocessing methods here #
-            self.meta.data['end_time_value'] = datetime.now()
-            self.collect_node_data()
-            self.collect_packet_data()
-            self.meta.data_save_to_file(self, simulation_filename)
-
-            print(f'########### FINISH ###########')
-            print(f'\tGENERATED PACKETS: {Packet.generated_count}')
-            print(f'\tARRIVED PACKETS: {Packet.arrived_count}')
-            print(f'\tDROPPED PACKETS: {Packet.dropped_count}')
-            print(f'\tPACKET LOSS RATE: {Packet.dropped_count/Packet.generated_count}')
-            print(f'\tTIME DIFFERENCE: {self.meta.data["end_time_value"] - self.meta.data["start_time_value"]}')
-            print(f'\tOVERALL THROUGHPUT: {self.meta.data["throughput_value"]/1e3} KBps')
-
+            self.finish_run(**kwargs)
+        if profiler is not None:
+            profiler.stop(self.tick)
 
 if __name__ == '__main__':
     print('Herein lies the Network class...')
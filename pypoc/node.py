@@ -7,7 +7,6 @@ __author__ = 'Hans Hofner'
 from collections import deque, defaultdict
 import copy
 import time
-import matplotlib.pyplot as plt
 import numpy as np
 import math
 import random
@@ -15,9 +14,8 @@ import itertools
 import logging
 import os
 
-import pypoc.models as models
+from pypoc.telemetry import Telemetry
 import networkx as nx
-import torch
 
 logging.basicConfig(level=logging.ERROR)
 LOGGER = logging.getLogger(__name__)
@@ -25,63 +23,101 @@ LOGGER = logging.getLogger(__name__)
 np.random.seed(11)
 
 class Packet:
+    '''
+    A packet is kept small since long runs hold millions of them: its path is
+    a tuple shared with every packet on the same route, and `hop` is the index
+    of the node it is currently at.
+    '''
+    __slots__ = ('id', 'size', 'destination', 'hop_table', 'path', 'hop',
+                 'born_tick', 'died_tick', 'status', 'memory_sets')
+
+    IN_FLIGHT = 0
+    ARRIVED = 1
+    DROPPED = 2
+
     arrived_count = 0
     dropped_count = 0
     generated_count = 0
 
+    # PacketRecords that packets add their record to when they die; set by
+    # the network
+    records = None
+
     @staticmethod
     def reset():
         Packet.arrived_count = 0
         Packet.dropped_count = 0
         Packet.generated_count = 0
 
-    def __init__(self, path, tick_time, size=1):
+    def __init__(self, path, tick_time, size=1, destination=None, hop_table=None):
         '''
         Increments the Packet class-wide generated_count variable and
         assigns object attributes.
 
-        :param path: List of Node objects representing a path from src to dest.
+        :param path: Tuple of Node objects representing a path from src to dest,
+                     or the start of it when following a `hop_table`. Not
+                     copied, so pass an interned path to share it.
         :param size: Integer representing an arbitrary size of the Packet.
+        :param destination: Destination Node, defaults to the last node of `path`.
+        :param hop_table: NextHopTable to follow once `path` runs out, or None
+                          for source routed packets.
         '''
         self.size: int = size
 
-        self._has_arrived = False
-        self._has_dropped = False
+        self.status = Packet.IN_FLIGHT
         self.id = Packet.generated_count
         Packet.generated_count += 1
 
-        self.destination = path[-1]
-        self.path_nodes = {'past': [], 'future': []}
-        self.path_nodes['past'].append(path[0])
-        self.path_nodes['future'].extend(path[1:])
+        self.destination = path[-1] if destination is None else destination
+        self.hop_table = hop_table
+        self.path = path if isinstance(path, tuple) else tuple(path)
+        self.hop = 0
 
         # The `tick` at which the packet object was instanitated
         self.born_tick = tick_time
         self.died_tick = None
 
-        self.memory_sets = []
+        # Only Q-Nodes ask for rewards, so this stays None for most packets
+        self.memory_sets = None
+
+        LOGGER.debug(f'Created packet {self} with path {self.path}')
 
-        LOGGER.debug(f'Created packet {self} with path {self.path_nodes}')
+    @property
+    def past_path(self):
+        '''
+        List of the nodes visited so far, including the current one.
+        '''
+        return list(self.path[:self.hop + 1])
+
+    @property
+    def delay(self):
+        return self.died_tick - self.born_tick
 
     def check_and_update_path(self, arrived_node, tick):
         '''
         Check if the Node that received `this` packet aligns with
-        the path, and if so, update. If path empty, it means it
-        arrived at destination node.
+        the path, and if so, update. If it is the destination node,
+        the packet has arrived.
 
         :param arrived_node: Node object
         '''
-        if arrived_node is self.path_nodes['future'][0]:
-            arrived_node = self.path_nodes['future'][0]
-            self.path_nodes['past'].append(arrived_node)
-            self.path_nodes['future'].remove(arrived_node)
+        path = self.path
+        next_hop = self.hop + 1
+        if next_hop < len(path):
+            if arrived_node is not path[next_hop]:
+                raise Exception(f'Next node in path does not match! '
+                                f'{arrived_node} =/= '
+                                f'{path[next_hop]}')
+        elif arrived_node is self.next_node:
+            # Following the hop table, the path grows as the packet moves
+            self.path = self.hop_table.paths.extend(path, arrived_node)
         else:
             raise Exception(f'Next node in path does not match! '
                             f'{arrived_node} =/= '
-                            f'{self.path_nodes["future"][0]}')
+                            f'{self.next_node}')
+        self.hop = next_hop
 
-        # If empty no more future
-        if not self.path_nodes['future']:
+        if arrived_node is self.destination:
             self.arrived(tick)
 
     def recal_path(self, path):
@@ -89,31 +125,32 @@ class Packet:
             raise Exception(f"Packet-{self} destination ({self.destination}) "
                     f"does not match new path destination ({path[-1]})")
 
-        self.path_nodes['future'].clear()
-        self.path_nodes['future'].extend(path)
+        self.path = self.path[:self.hop + 1] + tuple(path)
 
     def arrived(self, tick):
-        if self._has_dropped:
+        if self.status == Packet.DROPPED:
             raise Exception(f'Packet can not have arrived AND be dropped!!!'
                     f' info from Packet {self} arrived method')
-        if not self._has_arrived:
+        if self.status != Packet.ARRIVED:
             Packet.arrived_count += 1
             self.died_tick = tick
-            self.delay = self.died_tick - self.born_tick
-        self._has_arrived = True
+            if Packet.records is not None:
+                Packet.records.add(self, Packet.ARRIVED)
+        self.status = Packet.ARRIVED
         # Update average delay
 
         self._record_reward()
 
     def dropped(self, tick):
-        if self._has_arrived:
+        if self.status == Packet.ARRIVED:
             raise Exception(f'Packet can not have arrived AND be dropped!!!'
                     f' info from Packet {self} dropped method')
-        if not self._has_dropped:
+        if self.status != Packet.DROPPED:
             Packet.dropped_count += 1
             self.died_tick = tick
-            self.delay = self.died_tick - self.born_tick
-        self._has_dropped = True
+            if Packet.records is not None:
+                Packet.records.add(self, Packet.DROPPED)
+        self.status = Packet.DROPPED
 
         self._record_reward()
 
@@ -124,26 +161,34 @@ class Packet:
         arrives. Collect references to "memory_set" objects that 
         can be directly updated by this node.
         '''
+        if self.memory_sets is None:
+            self.memory_sets = []
         self.memory_sets.append(memory_set)
 
     def _record_reward(self):
-        if self._has_arrived and self._has_dropped:
-            raise Exception('Something is off, both has_arrived AND has_dropped are marked true')
+        if not self.memory_sets:
+            pass
         else:
-            if not self.memory_sets:
-                pass
-            else:
-                # Start updating all memory sets
-                for memory_set in self.memory_sets:
-                    if self._has_arrived:
-                        memory_set['reward'] = torch.tensor([1/self.delay])
-                    else:
-                        memory_set['reward'] = torch.tensor([float(-self.delay)])
+            # Only Q-nodes ask for rewards, so torch is imported by then
+            import torch
+            # Start updating all memory sets
+            for memory_set in self.memory_sets:
+                if self.status == Packet.ARRIVED:
+                    memory_set['reward'] = torch.tensor([1/self.delay])
+                else:
+                    memory_set['reward'] = torch.tensor([float(-self.delay)])
             self.memory_sets.clear()
 
     @property
     def next_node(self):
-        return self.path_nodes['future'][0]
+        '''
+        Next Node on the path, or None if the packet follows a hop table that
+        has no route from its current node.
+        '''
+        next_hop = self.hop + 1
+        if next_hop < len(self.path) or self.hop_table is None:
+            return self.path[next_hop]
+        return self.hop_table.next_hop(self.path[self.hop], self.destination)
 
     def __str__(self):
         return f'packet_{self.id}'
@@ -175,6 +220,7 @@ class Node:
             raise TypeError(f'Invalid type for Node.node_type {self.node_type}')
         self.node_type = node_type
         self.time = 1
+        self.last_run_tick = 0
         self.packet_size = 1
         self.step_value = step_value
 
@@ -205,7 +251,8 @@ class Node:
         self.wait_queue.append(received_packet)
         if self.node_type == 2:
             network.update_byte_count(received_packet)
-        self.data['received_packets'].append(received_packet)
+        self.data['received_packets'].record(received_packet)
+        network.activate(self)
 
     def run(self, network):
         '''
@@ -216,11 +263,40 @@ class Node:
             self.relay(network)
 
         self.update_queue(network)
-        self.update_data()
+        self.update_data(network.tick)
 
     def reset_values(self, network):
         pass
 
+    def link_added(self, neighbor, tick_value):
+        '''
+        Called by the network when a link from this node to `neighbor` is added.
+
+        :param tick_value: Seconds it takes to send one packet over the link.
+        '''
+        pass
+
+    def link_removed(self, neighbor):
+        '''
+        Called by the network when the link from this node to `neighbor` is removed.
+        '''
+        pass
+
+    # Nodes that move are run on every tick; see MovingNode.is_mobile
+    is_mobile = False
+
+    def next_active_tick(self, network):
+        '''
+        Earliest tick at which running this node can change anything. Used by
+        the event engine to skip the ticks a node would sit idle.
+
+        :return: Integer tick, or None if the node only needs to run again
+                 once it receives a packet.
+        '''
+        if self.wait_queue or (self.queue and self.node_type != 2):
+            return network.tick + 1
+        return None
+
     def update_dest_node_list(self, network, dest_ids=None):
         if not dest_ids:
             max_destination_node_count = 6
@@ -238,14 +314,26 @@ class Node:
         '''
         Initialize data structure for node.
         '''
-        self.data = {'queue_size': [len(self.queue)],
-                     'transmitted_packets': [],
-                     'relayed_packets': [],
-                     'received_packets': [],
-                     }
+        self.data = Telemetry()
+        self.data.series('queue_size', dtype=np.int64).record(0, len(self.queue))
+        self.data.log('transmitted_packets')
+        self.data.log('relayed_packets')
+        self.data.log('received_packets')
 
-    def update_data(self):
-        self.data['queue_size'].append(len(self.queue))
+    def update_data(self, tick):
+        self.data['queue_size'].record(tick, len(self.queue))
+
+    def catch_up_data(self, tick):
+        '''
+        Repeat the last recorded values for the ticks this node sat idle, so
+        per-tick data stays aligned with the network tick when the node is not
+        run on every tick.
+
+        :param tick: Tick the node is about to be run at.
+        '''
+        queue_size = self.data['queue_size']
+        queue_size.fill(self.last_run_tick + 1, tick - 1, queue_size.last_value)
+        self.last_run_tick = tick
 
     def update_queue(self, network):
         '''
@@ -274,7 +362,7 @@ class Node:
         for key in self.data.keys():
             if key == 'queue_size':
                 pretty_data += f'\n\t{key}\n\t\t'
-                length = self.data[key][-1]
+                length = self.data[key].last_value
                 pretty_data += f'length: {length}'
             else:
                 pretty_data += f'\n\t{key}\n\t\t'
@@ -288,7 +376,7 @@ class Node:
             self.update_dest_node_list(network)
 
         next_hop_tries = 0
-        if not network[self]:
+        if not network.graph_store.out_degree(self):
             return None
 
         while True:
@@ -299,7 +387,7 @@ class Node:
 
             if next_hop is None:
                 try:
-                    path = nx.shortest_path(network, self, dest, weight='Channel')
+                    path, hop_table = network.routes.route(self, dest)
                 except nx.exception.NetworkXNoPath:
                     LOGGER.warning(f'No path from {self} -> {dest}, next_hop_tries: {next_hop_tries}')
                     next_hop_tries += 1
@@ -308,8 +396,8 @@ class Node:
             else:
                 # TODO: This is dangerous because next_hop might not exist.
                 try:
-                    path = nx.shortest_path(network, next_hop, dest, weight='Channel')
-                    path = [self] + path
+                    path, hop_table = network.routes.route(next_hop, dest)
+                    path = (self,) + path
                 except nx.exception.NetworkXNoPath:
                     LOGGER.warning(f'No path {self} -> {dest}, next_hop_tries: {next_hop_tries}')
                     next_hop_tries += 1
@@ -319,7 +407,7 @@ class Node:
 
         # TODO: Implement the functionality of nodes that can't reach
         # the destination from next_hop -- for now assume they can
-        return Packet(path, network.tick, size=self.packet_size)
+        return network.new_packet(path, network.tick, size=self.packet_size, destination=dest, hop_table=hop_table)
 
     def set_name(self, name_of_node):
         self.name = name_of_node
@@ -366,11 +454,23 @@ class MovingNode(Node):
 
     def initalize_data(self):
         super().initalize_data()
-        self.data.update({'position_list': []})
+        self.data.series('position_list', width=3)
+
+    def update_data(self, tick):
+        super().update_data(tick)
+        self.data['position_list'].record(tick, self.position)
 
-    def update_data(self):
-        super().update_data()
-        self.data['position_list'].append(self.position)
+    def catch_up_data(self, tick):
+        self.data['position_list'].fill(self.last_run_tick + 1, tick - 1, self.position)
+        super().catch_up_data(tick)
+
+    @property
+    def is_mobile(self):
+        '''
+        True while the node may move: mobility models take a step (and draw
+        random numbers) every tick, so a mobile node is run on every tick.
+        '''
+        return self.mobility_model is not None and (self.is_moving or not self.is_mobility_object_set)
 
     def run(self, network):
         if self.node_type == 0:
@@ -380,7 +480,7 @@ class MovingNode(Node):
 
         self.move(network)
         self.update_queue(network)
-        self.update_data()
+        self.update_data(network.tick)
 
     def move(self, network):
         if not self.is_mobility_object_set:
@@ -442,7 +542,7 @@ class VaryingTransmitNode(MovingNode):
                 number_of_packets = int(round(number_of_packets))
 
                 temp_generated_bytes = 0
-                if not network[self]:
+                if not network.graph_store.out_degree(self):
                     self._leftover_packets += number_of_packets
                 for _ in range(number_of_packets):
                     fresh_packet = self.create_packet(network)
@@ -453,14 +553,28 @@ class VaryingTransmitNode(MovingNode):
 
             self.next_gen_time += 1/network.step_value
 
+    def next_active_tick(self, network):
+        next_tick = super().next_active_tick(network)
+        if self.node_type == 0:
+            # `_generate` fires on the first tick strictly past `next_gen_time`
+            generate_tick = max(math.floor(self.next_gen_time) + 1, network.tick + 1)
+            if next_tick is None or generate_tick < next_tick:
+                next_tick = generate_tick
+        return next_tick
+
     def _transmit(self, network):
         try:
             packet = self.queue.pop()
         except IndexError:
             pass
         else:
-            packet.next_node.receive(network, packet)
-            self.data['transmitted_packets'].append(packet)
+            next_node = packet.next_node
+            if next_node is None:
+                # Lost its route while waiting in the queue
+                packet.dropped(network.tick)
+                return
+            next_node.receive(network, packet)
+            self.data['transmitted_packets'].record(packet)
 
     # TODO: Consider different bandwidths
     def transmit(self, network):
@@ -472,7 +586,7 @@ class VaryingTransmitNode(MovingNode):
     def update_neighbor_counter(self, network):
         self.neighor_counter_updated = True
         try:
-            self.neighbor = (n for n in itertools.cycle(nx.neighbors(network, self)))
+            self.neighbor = (n for n in itertools.cycle(network.graph_store.successors(self)))
         except:
             raise
 
@@ -485,44 +599,50 @@ class VaryingRelayNode(VaryingTransmitNode):
     def __init__(self, node_type, step_value, mobility_model, packet_size, gen_rate):
         super().__init__(node_type, step_value, mobility_model, packet_size, gen_rate)
 
-        self.neighbor_ok_list_updated = False  # Next tick its ok to send
-        self.neighbor_edge_list_updated = False
+        # Link tables of the outgoing links, kept up to date by the network
+        self.next_ok_tick_for = {}  # Next tick its ok to send
+        self.edge_tick_val_for = {}
 
     def relay(self, network):
         LOGGER.debug(f"Relaying from this node {self}")
-        if not self.neighbor_ok_list_updated:
-            self.update_neighbor_ok_list(network)
-
-        if not self.neighbor_edge_list_updated:
-            self.update_neighbor_edge_list(network)
-
         if len(self.queue) > 0:
             packet = self.queue[-1]
 
+            next_node = packet.next_node
+
             try:
-                if network.tick >= self.next_ok_tick_for[packet.next_node]:
+                if network.tick >= self.next_ok_tick_for[next_node]:
                     # Update next ok tick
-                    self.next_ok_tick_for[packet.next_node] += self.edge_tick_val_for[packet.next_node] / network.step_value
+                    self.next_ok_tick_for[next_node] += self.edge_tick_val_for[next_node] / network.step_value
 
                     packet = self.queue.pop()
-                    packet.next_node.receive(network, packet)
-                    self.data['relayed_packets'].append(packet)
+                    next_node.receive(network, packet)
+                    self.data['relayed_packets'].record(packet)
             except KeyError:
                 # TODO: Develop retry mechanism
                 # Drop packet if not possible to get
                 packet = self.queue.pop(); packet.dropped(network.tick)
 
-    def update_neighbor_ok_list(self, network):
-        self.next_ok_tick_for = {neighbor:0 for neighbor in nx.neighbors(network, self)}
-        self.neighbor_ok_list_updated = True
+    def next_active_tick(self, network):
+        if self.node_type != 1 or self.wait_queue or not self.queue:
+            return super().next_active_tick(network)
+        try:
+            free_tick = self.next_ok_tick_for[self.queue[-1].next_node]
+        except KeyError:
+            # The packet will be dropped on the next run
+            return network.tick + 1
+        return max(math.ceil(free_tick), network.tick + 1)
+
+    def link_added(self, neighbor, tick_value):
+        self.next_ok_tick_for[neighbor] = 0
+        self.edge_tick_val_for[neighbor] = tick_value
 
-    def update_neighbor_edge_list(self, network):
-        self.edge_tick_val_for = {e[1]:e[2]['TickValue'] for e in network.edges.data() if e[0] is self}
-        self.neighbor_edge_list_updated = True
+    def link_removed(self, neighbor):
+        del self.next_ok_tick_for[neighbor]
+        del self.edge_tick_val_for[neighbor]
 
     def reset_values(self, network):
-        self.update_neighbor_edge_list(network)
-        self.update_neighbor_ok_list(network)
+        self.next_ok_tick_for = dict.fromkeys(self.next_ok_tick_for, 0)
 
 
 class RestrictedNode(VaryingRelayNode):
@@ -538,7 +658,7 @@ class RestrictedNode(VaryingRelayNode):
 
     def initalize_data(self):
         super().initalize_data()
-        self.data.update({'dropped_packets': []})
+        self.data.log('dropped_packets')
 
     def update_queue(self, network):
         current_queue_size = self.get_queue_size()
@@ -552,7 +672,7 @@ class RestrictedNode(VaryingRelayNode):
         if len(self.wait_queue) > 0:
             for packet in self.wait_queue:
                 packet.dropped(network.tick)
-            self.data['dropped_packets'].append(packet)
+            self.data['dropped_packets'].record(packet)
             self.wait_queue.clear()
 
 class RestrictedMovingNode(MovingNode):
@@ -568,7 +688,7 @@ class RestrictedMovingNode(MovingNode):
 
     def initalize_data(self):
         super().initalize_data()
-        self.data.update({'dropped_packets': []})
+        self.data.log('dropped_packets')
 
     def update_queue(self, network):
         current_queue_size = self.get_queue_size()
@@ -582,5 +702,5 @@ class RestrictedMovingNode(MovingNode):
         if len(self.wait_queue) > 0:
             for packet in self.wait_queue:
                 packet.dropped(network.tick)
-            self.data['dropped_packets'].append(packet)
+            self.data['dropped_packets'].record(packet)
             self.wait_queue.clear()
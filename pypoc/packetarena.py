@@ -0,0 +1,271 @@
+'''
+Struct-of-arrays storage for packets, selected with `packet-store = "arena"`.
+
+With the default `"objects"` store every packet is a Packet object. In long
+runs the number of live objects, not their bytes, becomes the limit. The
+PacketArena keeps every packet as one row of NumPy columns instead, and hands
+out PacketRef objects: plain integers (the row) that read and write their row
+through the same attributes and methods as Packet, so nodes work with either
+store. A PacketRef is a bare int with no attributes of its own: it holds no
+references and can not be part of a cycle.
+'''
+
+__author__ = 'Hans Hofner'
+
+import logging
+
+import numpy as np
+
+from pypoc.node import Packet
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+
+class PacketArena:
+    '''
+    Columns of packet data, one row per packet. The row of a packet is its id.
+    Nodes and paths are stored as indices into `nodes` and `paths`.
+    '''
+    columns = {'size': np.int64,
+               'born_tick': np.int64,
+               'died_tick': np.int64,
+               'destination': np.int32,
+               'path': np.int32,
+               'hop': np.int32,
+               'hop_table': np.int8,
+               'status': np.int8}
+
+    def __init__(self, capacity=1024):
+        self.count = 0
+        for name, dtype in PacketArena.columns.items():
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+
+        self.nodes = []  # Index -> Node
+        self._node_index = {}
+        self.paths = []  # Index -> path tuple
+        self._path_index = {}
+        self.hop_tables = [None]  # Index -> hop table; 0 for source routed packets
+        self._hop_table_index = {None: 0}
+        self.memory_sets = {}  # Row -> memory sets of packets a Q-Node asked rewards for
+
+    def add_hop_table(self, hop_table):
+        '''
+        Register the hop table packets may follow (the network's NextHopTable).
+        '''
+        if hop_table not in self._hop_table_index:
+            self._hop_table_index[hop_table] = len(self.hop_tables)
+            self.hop_tables.append(hop_table)
+
+    def new(self, path, tick_time, size=1, destination=None, hop_table=None):
+        '''
+        Store a new packet. Takes the same arguments as Packet.
+
+        :return: PacketRef to it.
+        '''
+        if self.count == len(self.size):
+            self._grow()
+        row = self.count
+        self.count += 1
+        Packet.generated_count += 1
+
+        self.size[row] = size
+        self.born_tick[row] = tick_time
+        self.died_tick[row] = -1
+        self.destination[row] = self.node_index(path[-1] if destination is None else destination)
+        self.path[row] = self.path_index(path if isinstance(path, tuple) else tuple(path))
+        self.hop[row] = 0
+        self.hop_table[row] = self._hop_table_index.get(hop_table)
+        self.status[row] = Packet.IN_FLIGHT
+        return PacketRef(row)
+
+    def node_index(self, node):
+        index = self._node_index.get(node)
+        if index is None:
+            index = self._node_index[node] = len(self.nodes)
+            self.nodes.append(node)
+        return index
+
+    def path_index(self, path):
+        index = self._path_index.get(path)
+        if index is None:
+            index = self._path_index[path] = len(self.paths)
+            self.paths.append(path)
+        return index
+
+    def drop(self, rows, tick):
+        '''
+        Drop the packets in `rows` at once; packets that already died are left
+        as they are.
+
+        :param rows: Sequence of packet rows (PacketRefs).
+        '''
+        rows = np.asarray(rows, dtype=np.int64)
+        if (self.status[rows] == Packet.ARRIVED).any():
+            raise Exception(f'Packet can not have arrived AND be dropped!!!'
+                            f' info from PacketArena drop method')
+        rows = rows[self.status[rows] == Packet.IN_FLIGHT]
+        self.status[rows] = Packet.DROPPED
+        self.died_tick[rows] = tick
+        Packet.dropped_count += len(rows)
+        for row in rows.tolist():
+            if Packet.records is not None:
+                Packet.records.add(PacketRef(row), Packet.DROPPED)
+            if row in self.memory_sets:
+                PacketRef(row)._record_reward()
+
+    def count_of(self, status):
+        '''
+        :return: Number of packets with `status` (e.g. Packet.ARRIVED).
+        '''
+        return int(np.count_nonzero(self.status[:self.count] == status))
+
+    def delays(self, status=Packet.ARRIVED):
+        '''
+        :return: Array of died_tick - born_tick of the packets with `status`.
+        '''
+        mask = self.status[:self.count] == status
+        return self.died_tick[:self.count][mask] - self.born_tick[:self.count][mask]
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in PacketArena.columns)
+
+    def _grow(self):
+        for name in PacketArena.columns:
+            column = getattr(self, name)
+            setattr(self, name, np.concatenate((column, np.zeros_like(column))))
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f'PacketArena(packets:{self.count}, paths:{len(self.paths)}, bytes:{self.nbytes()})'
+
+
+class PacketRef(int):
+    '''
+    A packet of the active PacketArena, by row. Behaves like a Packet.
+    '''
+    __slots__ = ()
+
+    # Arena the references point into; set when a run uses the arena store
+    arena = None
+
+    @property
+    def id(self):
+        return int(self)
+
+    @property
+    def size(self):
+        return int(PacketRef.arena.size[self])
+
+    @property
+    def born_tick(self):
+        return int(PacketRef.arena.born_tick[self])
+
+    @property
+    def died_tick(self):
+        died_tick = int(PacketRef.arena.died_tick[self])
+        return None if died_tick < 0 else died_tick
+
+    @property
+    def delay(self):
+        return self.died_tick - self.born_tick
+
+    @property
+    def destination(self):
+        arena = PacketRef.arena
+        return arena.nodes[arena.destination[self]]
+
+    @property
+    def hop_table(self):
+        arena = PacketRef.arena
+        return arena.hop_tables[arena.hop_table[self]]
+
+    @property
+    def path(self):
+        arena = PacketRef.arena
+        return arena.paths[arena.path[self]]
+
+    @property
+    def hop(self):
+        return int(PacketRef.arena.hop[self])
+
+    @property
+    def status(self):
+        return int(PacketRef.arena.status[self])
+
+    @property
+    def past_path(self):
+        return list(self.path[:self.hop + 1])
+
+    @property
+    def next_node(self):
+        path, hop = self.path, self.hop
+        if hop + 1 < len(path) or self.hop_table is None:
+            return path[hop + 1]
+        return self.hop_table.next_hop(path[hop], self.destination)
+
+    def check_and_update_path(self, arrived_node, tick):
+        arena = PacketRef.arena
+        path, hop = self.path, self.hop
+        if hop + 1 < len(path):
+            if arrived_node is not path[hop + 1]:
+                raise Exception(f'Next node in path does not match! '
+                                f'{arrived_node} =/= '
+                                f'{path[hop + 1]}')
+        elif arrived_node is self.next_node:
+            arena.path[self] = arena.path_index(self.hop_table.paths.extend(path, arrived_node))
+        else:
+            raise Exception(f'Next node in path does not match! '
+                            f'{arrived_node} =/= '
+                            f'{self.next_node}')
+        arena.hop[self] = hop + 1
+
+        if arrived_node is self.destination:
+            self.arrived(tick)
+
+    def recal_path(self, path):
+        if path[-1] != self.destination:
+            raise Exception(f"Packet-{self} destination ({self.destination}) "
+                    f"does not match new path destination ({path[-1]})")
+        arena = PacketRef.arena
+        arena.path[self] = arena.path_index(self.path[:self.hop + 1] + tuple(path))
+
+    def arrived(self, tick):
+        arena = PacketRef.arena
+        status = arena.status[self]
+        if status == Packet.DROPPED:
+            raise Exception(f'Packet can not have arrived AND be dropped!!!'
+                    f' info from Packet {self} arrived method')
+        if status != Packet.ARRIVED:
+            Packet.arrived_count += 1
+            arena.died_tick[self] = tick
+            if Packet.records is not None:
+                Packet.records.add(self, Packet.ARRIVED)
+        arena.status[self] = Packet.ARRIVED
+        self._record_reward()
+
+    def dropped(self, tick):
+        PacketRef.arena.drop([self], tick)
+
+    def reward_request(self, memory_set):
+        PacketRef.arena.memory_sets.setdefault(int(self), []).append(memory_set)
+
+    def _record_reward(self):
+        memory_sets = PacketRef.arena.memory_sets.pop(int(self), None)
+        if not memory_sets:
+            return
+        # Only Q-nodes ask for rewards, so torch is imported by then
+        import torch
+        for memory_set in memory_sets:
+            if self.status == Packet.ARRIVED:
+                memory_set['reward'] = torch.tensor([1/self.delay])
+            else:
+                memory_set['reward'] = torch.tensor([float(-self.delay)])
+
+    def __str__(self):
+        return f'packet_{int(self)}'
+
+    def __repr__(self):
+        return f'PacketRef(ID:{int(self)}, SIZE:{self.size})'
@@ -5,7 +5,6 @@ Plotting module.
 __author__ = 'Hans Hofner'
 
 import os
-import csv
 import time
 from collections import defaultdict
 
@@ -16,6 +15,7 @@ import networkx as nx
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 from pypoc.topology import Topology
+from pypoc.reader import read_results, run_summary, is_results_file
 
 def get_filepath(filepath=None, sim_directory='./simulation_data'):
     if filepath is None:
@@ -36,12 +36,13 @@ def get_filepath(filepath=None, sim_directory='./simulation_data'):
     else:
         if not os.path.isfile(filepath):
             raise Exception(f'`{filepath}` is not a valid filepath.')
+        return filepath
 
 def get_datafiles_from_directory(directory_path):
-    ''' Fetch all CSV files from the directory'''
+    ''' Fetch all run files (results files and CSV files) from the directory'''
     datafiles = []
     for file in os.listdir(directory_path):
-        if os.path.isfile(os.path.join(file, directory_path)) and file[-3:] == 'csv':
+        if os.path.isfile(os.path.join(file, directory_path)) and is_results_file(file):
             datafiles.append(os.path.join(file, directory_path))
 
     return datafiles
@@ -62,23 +63,18 @@ def plot_all(filepath=None, sim_directory='./simulation_data'):
 
     fig, ax = plt.subplots(fshape)
 
-    with open(filepath, mode='r') as csvfile:
-        reader = csv.reader(csvfile, delimiter=',')
+    run = read_results(filepath)
 
-        number_of_queue_plots = 10
+    number_of_queue_plots = 10
 
-        for row in reader:
-            # Queue Lengths
-            temp_ql_data = []
-            if 'rel_queue_size' in row[0]:
-                for data_point in row[1:]:
-                    temp_ql_data.append(int(data_point))
-                if will_plot['queue_size'] and number_of_queue_plots > 0:
-                    ax.plot(temp_ql_data, label=row[0])
-                    number_of_queue_plots -= 1
+    # Queue Lengths
+    for node, queue_sizes in run.node_series('queue_size', kind='rel').items():
+        if will_plot['queue_size'] and number_of_queue_plots > 0:
+            ax.plot(queue_sizes, label=node)
+            number_of_queue_plots -= 1
 
-            if will_plot['packet_stats']:
-                pass
+    if will_plot['packet_stats']:
+        pass
 
     plt.legend(loc='upper right')
 
@@ -93,21 +89,13 @@ def plot_packet_simple(filepath=None, sim_directory='./simulation_data', more_fi
     # Plot singular
     if more_filepaths is None:
         filepath = get_filepath(filepath, sim_directory)
-        with open(filepath, mode='r') as csvfile:
-            reader = csv.reader(csvfile, delimiter=',')
-            bars = {}
-            for row in reader:
-                if 'packet_generated_value' in row[0]:
-                    generated_value = int(row[1])
-                    bars['Generated'] = generated_value
-                if 'packet_drop_value' in row[0]:
-                    drop_value = int(row[1])
-                    bars['Dropped'] = drop_value
-                if 'packet_arrive_value' in row[0]:
-                    arrive_value = int(row[1])
-                    bars['Arrived'] = arrive_value
-
-            ax.bar(bars.keys(), bars.values(), color=['r', 'g', 'b'])
+        summary = run_summary(filepath)
+        bars = {}
+        bars['Generated'] = int(summary['packet_generated_value'])
+        bars['Dropped'] = int(summary['packet_drop_value'])
+        bars['Arrived'] = int(summary['packet_arrive_value'])
+
+        ax.bar(bars.keys(), bars.values(), color=['r', 'g', 'b'])
 
     # Plot multiple
     else:
@@ -115,18 +103,10 @@ def plot_packet_simple(filepath=None, sim_directory='./simulation_data', more_fi
         arrived_values = []
         dropped_values = []
         for filepath in more_filepaths:
-            with open(filepath, mode='r') as csvfile:
-                reader = csv.reader(csvfile, delimiter=',')
-                for row in reader:
-                    if 'packet_generated_value' in row[0]:
-                        g_val = int(row[1])
-                        generated_values.append(g_val)
-                    if 'packet_drop_value' in row[0]:
-                        d_val = int(row[1])
-                        dropped_values.append(d_val)
-                    if 'packet_arrive_value' in row[0]:
-                        a_val = int(row[1])
-                        arrived_values.append(a_val)
+            summary = run_summary(filepath)
+            generated_values.append(int(summary['packet_generated_value']))
+            dropped_values.append(int(summary['packet_drop_value']))
+            arrived_values.append(int(summary['packet_arrive_value']))
 
         width = 0.55
         indices = np.arange(len(generated_values))
@@ -153,17 +133,9 @@ def plot_queue_simple(filepath=None, sim_directory='./simulation_data', more_fil
             #   calculate the average for all at every point
             # Then plot
             for filepath in file_set:
-                temp_data = []
                 # Collect data
-                with open(filepath, mode='r') as csvfile:
-                    print(f'{">" * 30} Parsing file: {filepath} {">" * 30}')
-                    reader = csv.reader(csvfile, delimiter=',')
-                    for row in reader:
-                        temp_row_data = []
-                        if 'rel' in row[0] and 'queue' in row[0]:
-                            for data_point in row[1:]:
-                                temp_row_data.append(int(data_point))
-                            temp_data.append(temp_row_data)
+                print(f'{">" * 30} Parsing file: {filepath} {">" * 30}')
+                temp_data = list(read_results(filepath).node_series('queue_size', kind='rel').values())
                 # Turn into DataFrame and compress columns into averages
                 queue_df = pd.DataFrame(temp_data)
                 averages = queue_df.mean().tolist()
@@ -179,17 +151,11 @@ def plot_queue_simple(filepath=None, sim_directory='./simulation_data', more_fil
         print(f'Plotting for {filepath}')
         times_plotted = 0
         node_qlength = defaultdict(list)
-        with open(filepath, mode='r') as csvfile:
-            reader = csv.reader(csvfile, delimiter=',')
-            for row in reader:
-                temp_ql_data = []
-                if 'queue_size' in row[0]:
-                    if 'dest-nodes' in row[0] or 'src-nodes' in row[0]:
-                        continue
-                    node_name = row[0].split('_')[3]
-                    for data_point in row[1:]:
-                        temp_ql_data.append(int(data_point))
-                    node_qlength[node_name].append(temp_ql_data)
+        for node, queue_sizes in read_results(filepath).node_series('queue_size').items():
+            if 'dest-nodes' in node or 'src-nodes' in node:
+                continue
+            node_name = node.split('_')[3]
+            node_qlength[node_name].append(queue_sizes)
         final_list = []
         # Go from dict to list
         for key in node_qlength.keys():
@@ -224,12 +190,11 @@ def plot_throughputs():
     # Get all CSV files and put them into batches
     for filename in os.listdir(dirpath):
         print(filename)
-        if filename[-3:] == 'csv':
+        if is_results_file(filename):
             batch_name = filename[:filename.index('_')]
             batch_sets[batch_name].append(os.path.join(dirpath, filename))
 
     print(f'Collected batches: {batch_sets}')
-    time.sleep(3)
 
     for batch_key in batch_sets:
         print(f'Plotting batch: {batch_key}')
@@ -238,16 +203,7 @@ def plot_throughputs():
         for filepath in sorted(batch_sets[batch_key], key=get_num):
             print(f'{">" * 15} parsing {filepath} {"<" * 15}')
 
-            with open(filepath, mode='r') as csvfile:
-                reader=csv.reader(csvfile)
-                for row in reader:
-                    try:
-                        if 'throughput_value' in row[0]:
-                            throughput_movement.append(float(row[1])/8)
-                            break
-                    except IndexError:
-                        input(f"IndexError for {filepath}: {row}")
-                        raise
+            throughput_movement.append(float(run_summary(filepath)['throughput_value'])/8)
             x_numbers.append(get_num(filepath))
         plt.plot(x_numbers, throughput_movement, label=f'{batch_key}')
 
@@ -262,14 +218,13 @@ def plot_drop_rate():
     fig, ax = plt.subplots()
 
     dirpath = 'i_gr_data/'; print(f'{"#"*25} Plotting from dir {dirpath}!!! {"#"*25}')
-    time.sleep(2)
 
     sim_set = []
     for i in range(1, 5):
         filepaths = []
         for file in os.listdir(dirpath):
             if f'thu_t{i}' in file or f'thur_t{i}' in file:
-                if '.csv' in file:
+                if is_results_file(file):
                     filepath = dirpath + file
                     filepaths.append(filepath)
         sim_set.append(filepaths)
@@ -283,22 +238,9 @@ def plot_drop_rate():
         for filepath in sorted(fileset, key=get_num):
             print(f'{">" * 15} parsing {filepath} {">" * 15}')
 
-            with open(filepath, mode='r') as csvfile:
-                reader=csv.reader(csvfile)
-                drop_value = None; generated_value = None
-                for row in reader:
-                    try:
-                        if 'packet_drop_value' in row[0]:
-                            drop_value = float(row[1])
-                    except IndexError:
-                        input(f"IndexError for {filepath}: {row}")
-                        raise
-                    try:
-                        if 'packet_generated_value' in row[0]:
-                            generated_value = float(row[1])
-                    except IndexError:
-                        input(f"IndexError for {filepath}: {row}")
-                        raise
+            summary = run_summary(filepath)
+            drop_value = float(summary['packet_drop_value'])
+            generated_value = float(summary['packet_generated_value'])
 
             drop_rates.append((drop_value/generated_value)*100)
 
@@ -0,0 +1,151 @@
+'''
+Where a run spends its time.
+
+A Profiler wraps the phases of a tick of a network in timers: the `run` of
+every node (by node class, e.g. `run:base-stations`), `update_channel_loads`,
+`update_throughput`, `update_drop_rate`, `handle_edges`, `_record_states`,
+`flush_results` and the `optimize_model` of Q-nodes. For every phase it adds
+up the calls, the wall and CPU time and the packets handed to a next node
+during it.
+
+Only the network that is profiled gets the timers, on its instances, so
+without a profiler the run takes no extra time at all:
+
+    python -m pypoc --run --profile
+
+prints a table of the phases and writes them as JSON next to the run file.
+Phases may overlap: a Q-node's `optimize_model` is part of its `run`.
+'''
+
+__author__ = 'Hans Hofner'
+
+import json
+import logging
+import time
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+# Methods of the network that are timed, as phases of their own name
+NETWORK_PHASES = ('collect_node_count', 'update_channel_loads', 'update_throughput', 'update_drop_rate',
+                  '_reschedule_after_refresh', '_record_states', 'flush_results')
+
+
+class Profiler:
+    '''
+    Calls, wall time, CPU time and packets per phase of a run.
+    '''
+    def __init__(self):
+        self.phases = {}  # Phase -> [calls, wall seconds, cpu seconds, packets]
+        self.packets = 0  # Packets handed to a next node so far
+        self._nodes = set()  # Ids of the nodes timed
+        self._start = None  # (wall, cpu) at `start`
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.ticks = 0
+
+    def instrument(self, network):
+        '''
+        Put the timers on the phases of `network` and its nodes.
+        '''
+        for name in NETWORK_PHASES:
+            self._wrap(network, name, name)
+        self._wrap(network.edge_handler, 'handle_edges', 'handle_edges')
+        self._instrument_nodes(network)
+
+        # Every packet handed to a next node activates it
+        activate = network.activate
+
+        def counted_activate(node):
+            self.packets += 1
+            return activate(node)
+        network.activate = counted_activate
+
+        # Topology refreshes may add nodes
+        handle_edges = network.edge_handler.handle_edges
+
+        def instrumented_handle_edges(*args, **kwargs):
+            changed = handle_edges(*args, **kwargs)
+            self._instrument_nodes(network)
+            return changed
+        network.edge_handler.handle_edges = instrumented_handle_edges
+
+    def _instrument_nodes(self, network):
+        for node in network.nodes:
+            if node.id in self._nodes:
+                continue
+            self._nodes.add(node.id)
+            node_class = getattr(node, 'name', type(node).__name__)
+            self._wrap(node, 'run', f'run:{node_class}')
+            if hasattr(node, 'optimize_model'):
+                self._wrap(node, 'optimize_model', f'optimize_model:{node_class}')
+
+    def _wrap(self, owner, attribute, phase):
+        '''
+        Replace method `attribute` of the instance `owner` by one that adds
+        its calls and time to `phase`.
+        '''
+        method = getattr(owner, attribute)
+        stats = self.phases.setdefault(phase, [0, 0.0, 0.0, 0])
+        perf_counter, process_time = time.perf_counter, time.process_time
+
+        def timed(*args, **kwargs):
+            packets = self.packets
+            wall, cpu = perf_counter(), process_time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                stats[0] += 1
+                stats[1] += perf_counter() - wall
+                stats[2] += process_time() - cpu
+                stats[3] += self.packets - packets
+        setattr(owner, attribute, timed)
+
+    def start(self):
+        self._start = (time.perf_counter(), time.process_time())
+
+    def stop(self, ticks):
+        '''
+        :param ticks: Ticks the run took.
+        '''
+        if self._start is not None:
+            self.wall += time.perf_counter() - self._start[0]
+            self.cpu += time.process_time() - self._start[1]
+            self._start = None
+        self.ticks = ticks
+
+    def report(self):
+        '''
+        :return: JSON serializable dict of the run ('wall', 'cpu', 'ticks',
+                 'packets') and its 'phases', slowest first, each with
+                 'calls', 'wall', 'cpu', 'packets' and 'wall_per_call'; times
+                 in seconds.
+        '''
+        phases = {}
+        for phase, (calls, wall, cpu, packets) in sorted(self.phases.items(), key=lambda item: -item[1][1]):
+            if calls:
+                phases[phase] = {'calls': calls, 'wall': wall, 'cpu': cpu, 'packets': packets,
+                                 'wall_per_call': wall / calls}
+        return {'wall': self.wall, 'cpu': self.cpu, 'ticks': self.ticks, 'packets': self.packets,
+                'phases': phases}
+
+    def write_json(self, filepath):
+        with open(filepath, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+    def format_table(self):
+        '''
+        :return: The report as a table, one line per phase.
+        '''
+        report = self.report()
+        lines = [f'{"phase":<36} {"calls":>9} {"wall s":>9} {"cpu s":>9} {"% wall":>7} {"us/call":>9} {"packets":>9}']
+        for phase, stats in report['phases'].items():
+            share = 100 * stats['wall'] / report['wall'] if report['wall'] else 0.0
+            lines.append(f'{phase:<36} {stats["calls"]:>9} {stats["wall"]:>9.3f} {stats["cpu"]:>9.3f} '
+                         f'{share:>7.1f} {stats["wall_per_call"] * 1e6:>9.1f} {stats["packets"]:>9}')
+        lines.append(f'{"total (calls: ticks)":<36} {report["ticks"]:>9} {report["wall"]:>9.3f} {report["cpu"]:>9.3f} '
+                     f'{100.0:>7.1f} {"":>9} {report["packets"]:>9}')
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return f'Profiler(phases:{len(self.phases)}, wall:{self.wall:.3f})'
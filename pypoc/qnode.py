@@ -66,13 +66,12 @@ class QNode(RestrictedMovingNode):
 
         self.optimizer = optim.RMSprop(self.policy_net.parameters())
         LOGGER.debug("Initiated Q-Node!")
-        time.sleep(2)
 
     def initalize_data(self):
         super().initalize_data()
-        self.data.update({'memory_set': []})
-        self.data.update({'loss':[]})
-        self.data.update({'q-values':[]})
+        self.data.log('memory_set')
+        self.data.log('loss')
+        self.data.log('q-values')
 
     def relay(self, network):
         LOGGER.debug(f'Relaying network from A Q-NODE node: {self}')
@@ -89,7 +88,7 @@ class QNode(RestrictedMovingNode):
             self.policy_net = self.policy_net.float()
             LOGGER.debug(f'Raw output from policy_net(state): {self.policy_net(self.state.float())}')
             selected_action = self.policy_net(self.state.float()).max(0)[1].view(1, 1)
-            self.data['q-values'].append(self.policy_net(self.state.float()).tolist())
+            self.data['q-values'].record(self.policy_net(self.state.float()).tolist())
             offload = bool(selected_action[0][0])
             LOGGER.debug(f'Selected action from policy net: {"offload" if offload else "dont_offload"}')
         else:
@@ -100,15 +99,17 @@ class QNode(RestrictedMovingNode):
             packet = self.queue.pop()
 
             if not offload:
-                packet.next_node.receive(network, packet)
-                self.data['relayed_packets'].append(packet)
+                next_node = packet.next_node
+                if next_node is None:
+                    packet.dropped(network.tick)
+                else:
+                    next_node.receive(network, packet)
+                    self.data['relayed_packets'].record(packet)
             else:
                 sat_node = network.get_sat_node()
                 # Create new path
                 try:
-                    new_path = random.choice(
-                            list(nx.all_shortest_paths(
-                                network, sat_node, packet.destination, weight="Channel")))
+                    new_path = random.choice(network.routes.equal_cost_paths(sat_node, packet.destination))
                 except nx.exception.NetworkXNoPath:
                     LOGGER.error(f"No path from sat {sat_node} to dest {packet.destination}")
                     raise
@@ -123,12 +124,16 @@ class QNode(RestrictedMovingNode):
             network.request_state(self, memory_set)
             packet.reward_request(memory_set)
 
-            self.data['memory_set'].append(memory_set)
+            self.data['memory_set'].record(memory_set)
 
         if not network.tick % self.NETWORK_UPDATE_TICK:
             LOGGER.debug('Updating target network')
             self.target_net.load_state_dict(self.policy_net.state_dict())
 
+    def next_active_tick(self, network):
+        # Training and epsilon decay happen on every tick, queue or not
+        return network.tick + 1
+
     def transmit(self, network):
         raise Exception('Q-LEARNING IMPLEMENTATION ONLY FOR RELAYING')
 
@@ -159,7 +164,7 @@ class QNode(RestrictedMovingNode):
 
         # Compute Huber loss
         loss = F.smooth_l1_loss(state_action_values, expected_state_action_values.unsqueeze(1))
-        self.data['loss'].append(loss.tolist())
+        self.data['loss'].record(loss.tolist())
 
         # Optimize the model
         self.optimizer.zero_grad()
@@ -178,11 +183,11 @@ class QNode(RestrictedMovingNode):
         state = np.zeros(self.max_neighbors**2)  # Array consists of neighbors and their neighbors as well
         # Collect packet size info for all neighbors, and neighbor of neighbors
         index = 0
-        for neighbor in nx.neighbors(network, self):
+        for neighbor in network.graph_store.successors(self):
             if index >= len(state):
                 break
             state[index] = len(neighbor.queue)
-            for neighbor_in_law in nx.neighbors(network, neighbor):
+            for neighbor_in_law in network.graph_store.successors(neighbor):
                 if index >= len(state) - 1:
                     break
                 index+=1
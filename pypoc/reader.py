@@ -0,0 +1,394 @@
+'''
+Reading the results of simulation runs, for plotting and analysis.
+
+`read_results` opens a run file once and returns a reader that hands out
+NumPy arrays by key, loading each one only when it is asked for:
+
+    run = read_results('output_data/base_config_01Jan21_10_00_00.pypoc')
+    run['network/throughput_list']       # array of the per-tick throughput
+    run.value('packet_drop_value')       # summary value
+    run.node_series('queue_size', kind='rel')
+    run.delays()                         # delays of the arrived packets, in ticks
+
+Both `.pypoc` results files and the CSV files of older runs (or of
+`output-format = "csv"`) are read. Keys are the array names of results files;
+the CSV keys (`throughput_list`, `node_12_rel_base-stations_queue_size`) are
+accepted as well. Arrays of a results file are read straight from the chunk
+index of its footer and memory mapped when they are stored in one chunk. For
+CSV files an index of key -> byte offset of its row is built on the first open
+and kept next to the file (`<file>.idx`), so later opens only read the rows
+they need.
+
+Tools that only need the summary values of many runs use `run_summary`, which
+reads the small summary file written next to every run instead.
+'''
+
+__author__ = 'Hans Hofner'
+
+import ast
+import csv
+import json
+import logging
+import os
+import re
+from fnmatch import fnmatchcase
+
+import numpy as np
+
+from pypoc.results import ResultsWriter, ARRIVED, read_index, dtype_from_json, read_summary, write_summary
+import pypoc.delaystats as delaystats
+from pypoc.delaystats import DelayHistogram, OUTCOMES, summary_of
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+RESULT_EXTENSIONS = (ResultsWriter.extension, '.csv')
+
+# Per-tick network lists, stored as network/<key>
+NETWORK_KEYS = {'throughput_list', 'drop_rate_list', 'node_count_list', 'generated_packet_list'}
+
+_NODE_KEY = re.compile(r'^(node_\d+_(?:src|rel|dest)_[^_]+)_(.+)$')
+_PACKET_KEY = re.compile(r'^packet_(\d+)_(path|born_tick|died_tick)$')
+
+
+def is_results_file(filename):
+    return filename.endswith(RESULT_EXTENSIONS)
+
+
+def results_files(directory):
+    '''
+    :return: Sorted list of the paths of the run files in `directory`.
+    '''
+    return sorted(os.path.join(directory, filename) for filename in os.listdir(directory)
+                  if is_results_file(filename))
+
+
+def canonical_key(key):
+    '''
+    :return: Array name of `key`, which may be a CSV key.
+    '''
+    if key in NETWORK_KEYS:
+        return f'network/{key}'
+    match = _NODE_KEY.match(key)
+    if match:
+        return f'nodes/{match.group(1)}/{match.group(2)}'
+    return key
+
+
+def read_results(filepath, mmap=True):
+    '''
+    :param mmap: Memory map arrays of results files where possible, instead
+                 of reading them into memory.
+    :return: ResultsFileReader or CsvResultsReader for the run file.
+    '''
+    if filepath.endswith('.csv'):
+        return CsvResultsReader(filepath)
+    return ResultsFileReader(filepath, mmap=mmap)
+
+
+# Values of the summary file of a run, as written by the network
+SUMMARY_KEYS = ('throughput_value', 'drop_rate_value', 'packet_drop_value',
+                'packet_arrive_value', 'packet_generated_value', 'step_value')
+
+
+def run_summary(filepath):
+    '''
+    Summary values of a run: its summary file, or, for runs without one, the
+    same values computed from the run file, which are then kept as its
+    summary file.
+
+    :return: Dict with the summary values, 'throughput_mean' and the delay
+             statistics (see DelayStats.summary), the delays in ticks.
+    '''
+    summary = read_summary(filepath)
+    if summary is not None:
+        return summary
+
+    run = read_results(filepath)
+    summary = {key: run.value(key) for key in SUMMARY_KEYS}
+    summary['title'] = run.value('title')
+    summary['ticks'] = run.value('ticks')
+    throughput = run.get('network/throughput_list')
+    summary['throughput_mean'] = float(throughput.mean()) if throughput is not None and len(throughput) else None
+    if run.value('average_delay') is not None:
+        summary.update((key, run.value(key)) for key in delaystats.SUMMARY_KEYS)
+        summary['delay_classes'] = run.value('delay_classes', {})
+    else:
+        summary.update(summary_of(run.delay_histogram()))
+    try:
+        write_summary(filepath, summary)
+    except OSError:
+        LOGGER.warning(f'Could not write the summary of {filepath}')
+    return summary
+
+
+class RunResults:
+    '''
+    Interface of the readers. Subclasses implement `keys`, `_load`, `value`
+    and `delays`.
+    '''
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._arrays = {}  # Key -> array, for the keys read so far
+
+    def __getitem__(self, key):
+        key = canonical_key(key)
+        array = self._arrays.get(key)
+        if array is None:
+            if key not in self:
+                raise KeyError(f'{key} is not in {self.filepath}')
+            array = self._arrays[key] = self._load(key)
+        return array
+
+    def __contains__(self, key):
+        return canonical_key(key) in self.keys()
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def matching(self, pattern):
+        '''
+        :return: Keys matching the shell-style `pattern`, e.g. 'nodes/*/loss'.
+        '''
+        return [key for key in self.keys() if fnmatchcase(key, pattern)]
+
+    def node_series(self, metric, kind=None):
+        '''
+        :param metric: Metric name, e.g. 'queue_size'.
+        :param kind: 'src', 'rel' or 'dest' to only get those nodes.
+        :return: Dict of node name -> array.
+        '''
+        series = {}
+        for key in self.matching(f'nodes/*/{metric}'):
+            node = key.split('/')[1]
+            if kind is None or node.split('_')[2] == kind:
+                series[node] = self[key]
+        return series
+
+    def delay_histogram(self, outcome=ARRIVED):
+        '''
+        :param outcome: ARRIVED or DROPPED, or None for both.
+        :return: DelayHistogram of the delays of the packets.
+        '''
+        return DelayHistogram.from_delays(self.delays(outcome))
+
+    @property
+    def step_value(self):
+        '''
+        Seconds per tick.
+        '''
+        return self.value('step_value')
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.filepath})'
+
+
+class ArrayResults(RunResults):
+    '''
+    Results of a run held as named arrays, a metadata table and summary
+    values, as `run_simulation` returns them.
+    '''
+    def __init__(self, arrays, metadata=None, summary=None, filepath=None):
+        super().__init__(filepath)
+        self._arrays = dict(arrays)
+        self.metadata = metadata or {}
+        self.summary = summary or {}
+
+    def keys(self):
+        return self._arrays.keys()
+
+    def _load(self, key):
+        return self._arrays[key]
+
+    def value(self, key, default=None):
+        '''
+        :return: Summary or metadata value `key` of the run.
+        '''
+        if key in self.summary:
+            return self.summary[key]
+        return self.metadata.get(key, default)
+
+    def packets(self):
+        '''
+        :return: Structured array of the packet table (see results.PACKET_DTYPE).
+        '''
+        return self['packets']
+
+    def delay_histogram(self, outcome=ARRIVED, source=None, destination=None):
+        '''
+        :param outcome: ARRIVED or DROPPED.
+        :param source: Class of the source nodes, e.g. 'src-nodes', or None
+                       for all; `destination` likewise.
+        :return: DelayHistogram of the delays of the packets. Runs with delay
+                 histograms get theirs, with an estimated sum and maximum;
+                 others get one of their packet table.
+        '''
+        if source is None and destination is None:
+            name = f'delays/{OUTCOMES[outcome]}'
+        else:
+            name = f'delays/{source}/{destination}/{OUTCOMES[outcome]}'
+        if name in self:
+            return DelayHistogram.from_counts(self[name])
+        if source is None and destination is None and 'delays/bucket_ticks' not in self:
+            return super().delay_histogram(outcome)
+        return DelayHistogram()
+
+    def delays(self, outcome=ARRIVED):
+        '''
+        :param outcome: ARRIVED or DROPPED, or None for both.
+        :return: Array of died tick - born tick of the packets.
+        '''
+        if 'packets' not in self:
+            return np.zeros(0, dtype=np.int64)
+        packets = self['packets']
+        if outcome is not None:
+            packets = packets[packets['outcome'] == outcome]
+        return packets['died_tick'] - packets['born_tick']
+
+
+class ResultsFileReader(ArrayResults):
+    '''
+    Reader of `.pypoc` results files.
+    '''
+    def __init__(self, filepath, mmap=True):
+        self.index, footer = read_index(filepath)
+        footer = footer or {}
+        super().__init__({}, footer.get('metadata'), footer.get('summary'), filepath)
+        self.mmap = mmap
+
+    def keys(self):
+        return self.index.keys()
+
+    def _load(self, key):
+        entry = self.index[key]
+        dtype = dtype_from_json(entry['dtype'])
+        chunks = entry['chunks']
+        if not chunks:
+            return np.zeros(entry['shape'], dtype=dtype)
+        row_shape = entry['shape'][1:]
+        parts = [np.memmap(self.filepath, dtype=dtype, mode='r', offset=offset, shape=tuple([rows] + row_shape))
+                 for offset, rows in chunks]
+        array = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        return array if self.mmap else np.array(array)
+
+
+class CsvResultsReader(RunResults):
+    '''
+    Reader of CSV run files, with one `key, v1, v2, ...` row per value.
+    '''
+    index_extension = '.idx'
+
+    def __init__(self, filepath):
+        super().__init__(filepath)
+        self.index = self._read_or_build_index()  # Key -> (offset, length) of its row
+        self._file = None
+
+    def keys(self):
+        return self.index.keys()
+
+    def _read_or_build_index(self):
+        '''
+        Load the key index kept next to the file, or build it with one pass
+        over the file and keep it, if the file changed since.
+        '''
+        stat = os.stat(self.filepath)
+        index_filepath = self.filepath + CsvResultsReader.index_extension
+        try:
+            with open(index_filepath) as f:
+                stored = json.load(f)
+            if stored['size'] == stat.st_size and stored['mtime'] == stat.st_mtime:
+                return stored['index']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        index = {}
+        offset = 0
+        with open(self.filepath, 'rb') as f:
+            for line in f:
+                key = line.split(b',', 1)[0].strip().decode()
+                index[canonical_key(key)] = (offset, len(line))
+                offset += len(line)
+        try:
+            with open(index_filepath, 'w') as f:
+                json.dump({'size': stat.st_size, 'mtime': stat.st_mtime, 'index': index}, f)
+        except OSError:
+            LOGGER.warning(f'Could not write the index of {self.filepath}')
+        return index
+
+    def _row(self, key):
+        '''
+        :return: List of the value strings of the row of `key`.
+        '''
+        if self._file is None:
+            self._file = open(self.filepath, 'rb')
+        offset, length = self.index[key]
+        self._file.seek(offset)
+        line = self._file.read(length).decode()
+        return next(csv.reader([line]))[1:]
+
+    def _load(self, key):
+        return _parse_values(self._row(key))
+
+    def value(self, key, default=None):
+        '''
+        :return: Value of the single-value row `key`, as int, float or str.
+        '''
+        if key not in self.index:
+            return default
+        values = self._row(key)
+        if not values:
+            return default
+        return _parse_value(values[0])
+
+    def delays(self, outcome=ARRIVED):
+        '''
+        :param outcome: ARRIVED or DROPPED, or None for both. Packets count as
+                        arrived when their path ends at a destination node.
+        :return: Array of died tick - born tick of the packets.
+        '''
+        delays = []
+        for key in self.index:
+            match = _PACKET_KEY.match(key)
+            if not match or match.group(2) != 'path':
+                continue
+            if outcome is not None:
+                path = self._row(key)
+                arrived = bool(path) and '_dest_' in path[-1]
+                if arrived != (outcome == ARRIVED):
+                    continue
+            packet = f'packet_{match.group(1)}'
+            born_tick = self.value(f'{packet}_born_tick')
+            died_tick = self.value(f'{packet}_died_tick')
+            if isinstance(born_tick, int) and isinstance(died_tick, int):
+                delays.append(died_tick - born_tick)
+        return np.array(delays, dtype=np.int64)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _parse_value(value):
+    for parse in (int, float):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _parse_values(values):
+    '''
+    :return: Array of CSV value strings: numbers, tuples of numbers (as rows)
+             or, failing those, strings.
+    '''
+    for dtype in (np.int64, np.float64):
+        try:
+            return np.array(values, dtype=dtype)
+        except ValueError:
+            pass
+    try:
+        return np.array([ast.literal_eval(value) for value in values], dtype=np.float64)
+    except (ValueError, SyntaxError, TypeError):
+        return np.array(values)
@@ -0,0 +1,225 @@
+'''
+Cache of finished runs, so that a sweep that is rerun or extended does not
+simulate the same point again.
+
+A run is stored under the hash of what decides its results: its normalized
+configuration (without the title and author, which only name it), its seed
+and the version of the simulator, the hash of the sources of the `pypoc`
+package. Runs without a `seed` are not reproducible and are not cached.
+
+    <directory>/<key[:2]>/<key>/
+        entry.json      key, configuration, creation time
+        run.pypoc       run file (run.csv for `output-format = "csv"`)
+        run.summary.json
+
+The modification time of an entry is its last use; `evict` removes entries
+older than `max_age` and then the least recently used ones until the cache is
+no larger than `max_size`.
+'''
+
+__author__ = 'Hans Hofner'
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+from pypoc.results import SUMMARY_EXTENSION, read_summary, summary_filepath, write_summary
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+# Keys of the configuration that do not change the results of a run
+UNKEYED = ('title', 'author')
+
+_simulator_version = None
+
+
+def simulator_version():
+    '''
+    :return: Hash of the sources of the `pypoc` package.
+    '''
+    global _simulator_version
+    if _simulator_version is None:
+        package = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for filename in sorted(os.listdir(package)):
+            if filename.endswith('.py'):
+                digest.update(filename.encode())
+                with open(os.path.join(package, filename), 'rb') as f:
+                    digest.update(f.read())
+        _simulator_version = digest.hexdigest()
+    return _simulator_version
+
+
+def _normalize(value):
+    '''
+    :return: `value` with sorted tables, integral floats as ints and NumPy
+             scalars as Python ones, so that equal configurations hash equal.
+    '''
+    if isinstance(value, dict):
+        return {str(key): _normalize(value[key]) for key in sorted(value, key=str)}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def config_key(configuration):
+    '''
+    :return: Cache key of a run of `configuration`, or None if it has no seed.
+    '''
+    seed = configuration.get('global', {}).get('seed')
+    if seed is None:
+        return None
+    normalized = _normalize({key: value for key, value in configuration.items() if key not in UNKEYED})
+    document = json.dumps({'configuration': normalized, 'seed': _normalize(seed),
+                           'simulator': simulator_version()}, sort_keys=True, default=str)
+    return hashlib.sha256(document.encode()).hexdigest()
+
+
+class ResultCache:
+    '''
+    Content-addressed store of run files and summaries.
+    '''
+    entry_filename = 'entry.json'
+
+    def __init__(self, directory, max_size=None, max_age=None):
+        '''
+        :param directory: Directory of the cache; created if needed.
+        :param max_size: Bytes the cache may take, or None for no limit.
+        :param max_age: Seconds an entry is kept since its last use, or None
+                        for no limit.
+        '''
+        if max_size is not None and max_size < 0:
+            raise Exception(f'Incorrect cache max size {max_size}; must be 0 or more')
+        if max_age is not None and max_age < 0:
+            raise Exception(f'Incorrect cache max age {max_age}; must be 0 or more')
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    def _entry_directory(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _run_filepath(self, entry_directory):
+        for filename in os.listdir(entry_directory):
+            if filename.startswith('run.') and not filename.endswith(SUMMARY_EXTENSION):
+                return os.path.join(entry_directory, filename)
+        return None
+
+    def get(self, configuration):
+        '''
+        :return: (run file, summary dict) of the cached run of `configuration`,
+                 or None on a miss.
+        '''
+        key = config_key(configuration)
+        if key is None:
+            return None
+        entry_directory = self._entry_directory(key)
+        if not os.path.isdir(entry_directory):
+            return None
+        filepath = self._run_filepath(entry_directory)
+        summary = read_summary(filepath) if filepath is not None else None
+        if summary is None:
+            LOGGER.warning(f'Removing incomplete cache entry {entry_directory}')
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            return None
+        os.utime(entry_directory)
+        return filepath, summary
+
+    def fetch(self, configuration, filepath):
+        '''
+        Copy the cached run of `configuration` to `filepath`, with its
+        summary file next to it. It is not linked: writers reopen their
+        output files in place, which would change the cache entry as well.
+
+        :return: Summary dict, or None on a miss.
+        '''
+        found = self.get(configuration)
+        if found is None:
+            return None
+        cached_filepath, summary = found
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        shutil.copyfile(cached_filepath, filepath)
+        summary = dict(summary, title=configuration.get('title', summary.get('title')))
+        write_summary(filepath, summary)
+        return summary
+
+    def put(self, configuration, filepath):
+        '''
+        Store the run file `filepath` of `configuration` and its summary file.
+
+        :return: True if the run was stored.
+        '''
+        key = config_key(configuration)
+        if key is None or not os.path.isfile(summary_filepath(filepath)):
+            return False
+        entry_directory = self._entry_directory(key)
+        if os.path.isdir(entry_directory):
+            return True
+
+        # Filled next to the entry and renamed, so a half written entry is never found
+        staging = f'{entry_directory}.{os.getpid()}.tmp'
+        os.makedirs(staging, exist_ok=True)
+        extension = os.path.splitext(filepath)[1]
+        shutil.copyfile(filepath, os.path.join(staging, 'run' + extension))
+        shutil.copyfile(summary_filepath(filepath), os.path.join(staging, 'run' + SUMMARY_EXTENSION))
+        with open(os.path.join(staging, ResultCache.entry_filename), 'w') as f:
+            json.dump({'key': key, 'created': time.time(), 'simulator': simulator_version(),
+                       'configuration': configuration}, f, indent=1, default=str)
+        try:
+            os.rename(staging, entry_directory)
+        except OSError:
+            # Stored by another process meanwhile
+            shutil.rmtree(staging, ignore_errors=True)
+        return True
+
+    def entries(self):
+        '''
+        :return: List of (entry directory, bytes, last use) of the cache.
+        '''
+        entries = []
+        for prefix in os.listdir(self.directory):
+            prefix_directory = os.path.join(self.directory, prefix)
+            if not os.path.isdir(prefix_directory):
+                continue
+            for key in os.listdir(prefix_directory):
+                entry_directory = os.path.join(prefix_directory, key)
+                if key.endswith('.tmp') or not os.path.isdir(entry_directory):
+                    continue
+                size = sum(os.path.getsize(os.path.join(entry_directory, filename))
+                           for filename in os.listdir(entry_directory))
+                entries.append((entry_directory, size, os.path.getmtime(entry_directory)))
+        return entries
+
+    def evict(self):
+        '''
+        Remove the entries older than `max_age`, then the least recently used
+        ones until the cache is no larger than `max_size`.
+
+        :return: Number of entries removed.
+        '''
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        now = time.time()
+        size = sum(entry[1] for entry in entries)
+        removed = 0
+        for entry_directory, entry_size, last_use in entries:
+            too_old = self.max_age is not None and now - last_use > self.max_age
+            too_large = self.max_size is not None and size > self.max_size
+            if not (too_old or too_large):
+                continue
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            size -= entry_size
+            removed += 1
+        return removed
+
+    def __repr__(self):
+        return f'ResultCache({self.directory}, max_size:{self.max_size}, max_age:{self.max_age})'
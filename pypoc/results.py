@@ -0,0 +1,543 @@
+'''
+Results file of a simulation run.
+
+At the end of a run, NetworkData used to write everything it had collected as
+one CSV file of `key, v1, v2, ...` rows, so the whole history was held in
+memory until then, a run that died early left nothing behind, and reading a
+single metric meant parsing the whole text. A run now writes a typed,
+columnar results file instead: the ResultsWriter appends the per-tick metrics
+and packet records in chunks, every `flush-ticks` ticks, and the run only
+keeps what was collected since the last flush.
+
+Arrays are named by path:
+
+    network/<key>           per-tick network values (`throughput_list`, ...)
+    nodes/<node>/<metric>   per-node series (`queue_size`, `position_list`, ...)
+    packets                 one record per finished packet, see PACKET_DTYPE
+    paths/nodes             node ids of all paths in `packets`, one after the other
+    paths/lengths           number of nodes of every path, by path id
+    delays/...              delay histograms, see pypoc.delaystats
+
+and take the dtype given for them in SCHEMA. The footer also holds a metadata
+table of the run (title, configuration, times, the nodes) and its summary
+values. `export_csv` writes a results file in the old CSV layout.
+
+A results file is append only:
+
+    header   MAGIC, format version
+    chunk    CHUNK_MAGIC, name, dtype, row shape, rows, then the raw C-order
+             array; chunks of the same name are concatenated on reading
+    ...
+    footer   FOOTER_MAGIC, JSON with the index of all chunks, the metadata
+             and the summary values of the run
+    trailer  offset of the footer, END_MAGIC
+
+Chunk data starts on 8-byte boundaries so it can be memory mapped. A file
+without a footer (the run was killed) is still readable: `scan_chunks` walks
+the chunks from the start.
+
+Every run also writes a small JSON summary file next to its data
+(`<run>.summary.json`, see `write_summary`) with its summary values and delay
+percentiles, so tools comparing many runs need not open the runs themselves.
+'''
+
+__author__ = 'Hans Hofner'
+
+import csv
+import json
+import logging
+import os
+import struct
+from fnmatch import fnmatchcase
+
+import numpy as np
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b'PYPOCRES'
+FORMAT_VERSION = 2
+CHUNK_MAGIC = b'CHNK'
+FOOTER_MAGIC = b'FOOT'
+END_MAGIC = b'PYPOCEND'
+
+_HEADER = struct.Struct('<8sI4x')  # magic, format version
+_CHUNK = struct.Struct('<4sHHBQ')  # magic, name length, dtype length, row dimensions, rows
+_FOOTER = struct.Struct('<4s4xQ')  # magic, JSON length
+_TRAILER = struct.Struct('<Q8s')  # footer offset, magic
+_ALIGNMENT = 8
+
+# Outcome of a packet in the packet table, as Packet.status
+ARRIVED, DROPPED = 1, 2
+
+# Nodes are stored by their id, see the 'nodes' of the metadata
+PACKET_DTYPE = np.dtype([('id', '<i8'),
+                         ('src', '<i4'),
+                         ('dst', '<i4'),
+                         ('born_tick', '<i8'),
+                         ('died_tick', '<i8'),
+                         ('hops', '<i4'),
+                         ('path_id', '<i4'),  # Index into the path table
+                         ('outcome', 'i1')])
+
+# Name pattern -> (dtype, unit) of the arrays a run writes. Arrays not listed
+# here keep the dtype NumPy picks for them.
+SCHEMA = {'network/throughput_list': ('<f8', 'bytes per second'),
+          'network/drop_rate_list': ('<f8', 'generated per dropped packet'),
+          'network/node_count_list': ('<i4', 'nodes'),
+          'nodes/*/queue_size': ('<i8', 'packets'),
+          'nodes/*/position_list': ('<f8', 'meters (x, y, z)'),
+          'nodes/*/loss': ('<f8', None),
+          'nodes/*/q-values': ('<f8', None),
+          'packets': (PACKET_DTYPE, 'ticks'),
+          'paths/nodes': ('<i4', 'node ids'),
+          'paths/lengths': ('<i4', 'nodes'),
+          'delays/bucket_ticks': ('<i8', 'ticks'),
+          'delays/*': ('<i8', 'packets per delay bucket')}
+
+
+def schema_for(name):
+    '''
+    :return: (dtype, unit) of array `name`, or (None, None) if the schema
+             does not list it.
+    '''
+    for pattern, (dtype, unit) in SCHEMA.items():
+        if fnmatchcase(name, pattern):
+            return np.dtype(dtype), unit
+    return None, None
+
+
+def _padding(size):
+    return -size % _ALIGNMENT
+
+
+def _dtype_to_json(dtype):
+    return json.dumps(np.lib.format.dtype_to_descr(dtype))
+
+
+def dtype_from_json(descr):
+    return np.lib.format.descr_to_dtype(json.loads(descr))
+
+
+class PacketRecords:
+    '''
+    Table of finished packets. A packet adds its record when it arrives or is
+    dropped; the path it took is interned into a path table, so packets that
+    took the same path share one entry.
+    '''
+    # Path objects whose path id is remembered by identity; the cache is
+    # dropped beyond this, as routing hands out new path objects over time
+    path_cache_size = 65536
+
+    def __init__(self, capacity=1024, stats=None, table=True):
+        '''
+        :param stats: DelayStats the packets are added to as well, if any.
+        :param table: Keep the records; if False packets only go to `stats`.
+        '''
+        self.stats = stats
+        self.table = table
+        self.count = 0  # Records not taken yet
+        self.total = 0  # Records ever added
+        self._records = np.zeros(capacity, dtype=PACKET_DTYPE)
+        self.paths = []  # Path id -> tuple of node ids
+        self._path_ids = {}  # Tuple of node ids -> path id
+        self._path_id_for = {}  # (id(path), hop) -> (path id, path)
+        self._taken_paths = 0
+
+    def add(self, packet, outcome):
+        '''
+        :param packet: Packet (or PacketRef) that just died.
+        :param outcome: ARRIVED or DROPPED.
+        '''
+        if self.stats is not None:
+            self.stats.add(packet, outcome)
+        if not self.table:
+            return
+        if self.count == len(self._records):
+            self._records = np.concatenate((self._records, np.zeros_like(self._records)))
+        path, hop = packet.path, packet.hop
+        self._records[self.count] = (packet.id, path[0].id, packet.destination.id,
+                                     packet.born_tick, packet.died_tick, hop,
+                                     self.path_id(path, hop), outcome)
+        self.count += 1
+        self.total += 1
+
+    def path_id(self, path, hop):
+        '''
+        :return: Id of the first `hop` + 1 nodes of `path` in the path table.
+        '''
+        key = (id(path), hop)
+        found = self._path_id_for.get(key)
+        if found is None:
+            visited = tuple(node.id for node in path[:hop + 1])
+            path_id = self._path_ids.get(visited)
+            if path_id is None:
+                path_id = self._path_ids[visited] = len(self.paths)
+                self.paths.append(visited)
+            if len(self._path_id_for) >= PacketRecords.path_cache_size:
+                self._path_id_for.clear()
+            # The path is kept with its id, so `id(path)` is not reused
+            found = self._path_id_for[key] = (path_id, path)
+        return found[0]
+
+    def records(self):
+        '''
+        :return: Structured array of the records not taken yet.
+        '''
+        return self._records[:self.count]
+
+    def take(self):
+        '''
+        Hand over the records and the paths added since the last call, to
+        stream them out.
+
+        :return: (structured array of records, list of new paths).
+        '''
+        records = self.records().copy()
+        self.count = 0
+        paths = self.paths[self._taken_paths:]
+        self._taken_paths = len(self.paths)
+        return records, paths
+
+    def __len__(self):
+        return self.total
+
+    def __repr__(self):
+        return f'PacketRecords(packets:{self.total}, paths:{len(self.paths)})'
+
+
+def split_paths(nodes, lengths):
+    '''
+    :return: List of paths, as arrays of node ids, from the 'paths/nodes' and
+             'paths/lengths' arrays.
+    '''
+    return np.split(nodes, np.cumsum(lengths)[:-1]) if len(lengths) else []
+
+
+def csv_packet_rows(packets, paths, name_for):
+    '''
+    Rows of the packet table in the CSV layout: path, born and died tick of
+    every packet.
+
+    :param packets: Structured array of packet records.
+    :param paths: Path id -> sequence of node ids.
+    :param name_for: Dict of node id -> node name; ids missing from it are
+                     written as they are.
+    '''
+    for packet in packets.tolist():
+        packet_id, born_tick, died_tick, path_id = packet[0], packet[3], packet[4], packet[6]
+        yield [f'packet_{packet_id}_path'] + [name_for.get(node_id, node_id) for node_id in paths[path_id]]
+        yield [f'packet_{packet_id}_born_tick', born_tick]
+        yield [f'packet_{packet_id}_died_tick', died_tick]
+
+
+class ResultsWriter:
+    '''
+    Appends named arrays to a results file. Rows are buffered per name and
+    written as one chunk per name on `flush`.
+    '''
+    extension = '.pypoc'
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.index = {}  # Name -> {'dtype', 'shape', 'unit', 'chunks': [[offset, rows], ...]}
+        self._buffers = {}  # Name -> list of arrays not written yet
+        self._file = open(filepath, 'wb')
+        self._file.write(_HEADER.pack(MAGIC, FORMAT_VERSION))
+        self._file.flush()
+
+    def append(self, name, values):
+        '''
+        Buffer rows of array `name`, converted to its dtype in SCHEMA.
+
+        :param values: Array-like of rows; scalars for a 1-d array, tuples
+                       for a table.
+        :raise TypeError: If the values are not numeric.
+        '''
+        dtype, _ = schema_for(name)
+        values = np.asarray(values, dtype=dtype)
+        if values.dtype.hasobject:
+            raise TypeError(f'Can not write {name}; its values are not numeric')
+        if values.ndim == 0:
+            values = values.reshape(1)
+        if len(values):
+            self._buffers.setdefault(name, []).append(values)
+
+    def flush(self):
+        '''
+        Write every buffered array as a chunk, and hand the bytes to the OS.
+        '''
+        for name, buffered in self._buffers.items():
+            self._write_chunk(name, np.concatenate(buffered) if len(buffered) > 1 else buffered[0])
+        self._buffers.clear()
+        self._file.flush()
+
+    def _write_chunk(self, name, values):
+        values = np.ascontiguousarray(values)
+        entry = self.index.get(name)
+        if entry is None:
+            entry = self.index[name] = {'dtype': _dtype_to_json(values.dtype),
+                                        'shape': [0] + list(values.shape[1:]),
+                                        'unit': schema_for(name)[1],
+                                        'chunks': []}
+        elif _dtype_to_json(values.dtype) != entry['dtype'] or list(values.shape[1:]) != entry['shape'][1:]:
+            # Later chunks take the layout of the first one
+            values = np.ascontiguousarray(values.astype(dtype_from_json(entry['dtype']))
+                                          .reshape([-1] + entry['shape'][1:]))
+
+        name_bytes = name.encode()
+        dtype_bytes = entry['dtype'].encode()
+        header = (_CHUNK.pack(CHUNK_MAGIC, len(name_bytes), len(dtype_bytes), values.ndim - 1, len(values))
+                  + name_bytes + dtype_bytes
+                  + struct.pack(f'<{values.ndim - 1}Q', *values.shape[1:]))
+        header += bytes(_padding(self._file.tell() + len(header)))
+        self._file.write(header)
+
+        entry['chunks'].append([self._file.tell(), len(values)])
+        entry['shape'][0] += len(values)
+        self._file.write(values.tobytes())
+        self._file.write(bytes(_padding(values.nbytes)))
+
+    def close(self, metadata=None, summary=None):
+        '''
+        Write what is still buffered, the footer and the trailer, and close
+        the file.
+
+        :param metadata: JSON serializable dict describing the run.
+        :param summary: JSON serializable dict of summary values of the run.
+        '''
+        if self._file.closed:
+            return
+        self.flush()
+        footer = json.dumps({'version': FORMAT_VERSION,
+                             'index': self.index,
+                             'metadata': metadata or {},
+                             'summary': summary or {}}, default=str).encode()
+        offset = self._file.tell()
+        self._file.write(_FOOTER.pack(FOOTER_MAGIC, len(footer)) + footer)
+        self._file.write(_TRAILER.pack(offset, END_MAGIC))
+        self._file.close()
+
+    def __repr__(self):
+        return f'ResultsWriter({self.filepath}, arrays:{len(self.index)})'
+
+
+class MemoryResults(ResultsWriter):
+    '''
+    ResultsWriter that keeps the arrays in memory instead of writing a file,
+    for `output-format = "memory"`. After `close`, `arrays` holds the
+    concatenated arrays by name and `metadata` and `summary` the footer.
+    '''
+    def __init__(self):
+        self.filepath = None
+        self.index = {}
+        self._buffers = {}
+        self.arrays = {}
+        self.metadata = {}
+        self.summary = {}
+
+    def flush(self):
+        # Everything stays buffered until `close`
+        pass
+
+    def close(self, metadata=None, summary=None):
+        for name, buffered in self._buffers.items():
+            first = buffered[0]
+            # Later rows take the layout of the first ones, as in a results file
+            self.arrays[name] = np.concatenate([values.astype(first.dtype).reshape((-1,) + first.shape[1:])
+                                                for values in buffered])
+        self._buffers.clear()
+        self.metadata = metadata or {}
+        self.summary = summary or {}
+
+    def __repr__(self):
+        return f'MemoryResults(arrays:{len(self.arrays)})'
+
+
+def read_footer(filepath):
+    '''
+    :return: Footer dict ('version', 'index', 'metadata', 'summary') of a
+             results file, or None if the file has no footer.
+    '''
+    with open(filepath, 'rb') as f:
+        _check_header(f, filepath)
+        size = _file_size(f)
+        if size < _HEADER.size + _TRAILER.size:
+            return None
+        f.seek(size - _TRAILER.size)
+        offset, magic = _TRAILER.unpack(f.read(_TRAILER.size))
+        if magic != END_MAGIC:
+            return None
+        f.seek(offset)
+        magic, length = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != FOOTER_MAGIC:
+            raise Exception(f'Corrupt results file {filepath}; footer not found')
+        return json.loads(f.read(length))
+
+
+def scan_chunks(filepath):
+    '''
+    Rebuild the chunk index of a results file by walking its chunks, for
+    files without a footer. A truncated last chunk is left out.
+
+    :return: Index dict in the layout of the footer 'index'.
+    '''
+    index = {}
+    with open(filepath, 'rb') as f:
+        _check_header(f, filepath)
+        size = _file_size(f)
+        while True:
+            header = f.read(_CHUNK.size)
+            if len(header) < _CHUNK.size:
+                break
+            magic, name_length, dtype_length, dimensions, rows = _CHUNK.unpack(header)
+            if magic != CHUNK_MAGIC:
+                break
+            name = f.read(name_length).decode()
+            dtype = f.read(dtype_length).decode()
+            row_shape = list(struct.unpack(f'<{dimensions}Q', f.read(8 * dimensions)))
+            f.seek(_padding(f.tell()), 1)
+            offset = f.tell()
+            nbytes = rows * dtype_from_json(dtype).itemsize * int(np.prod(row_shape, dtype=np.int64))
+            if offset + nbytes > size:
+                break
+            f.seek(offset + nbytes + _padding(nbytes))
+            entry = index.setdefault(name, {'dtype': dtype, 'shape': [0] + row_shape,
+                                            'unit': schema_for(name)[1], 'chunks': []})
+            entry['chunks'].append([offset, rows])
+            entry['shape'][0] += rows
+    return index
+
+
+def read_index(filepath):
+    '''
+    :return: (index, footer) of a results file; the footer is None for files
+             without one, whose index is rebuilt with `scan_chunks`.
+    '''
+    footer = read_footer(filepath)
+    if footer is None:
+        LOGGER.warning(f'{filepath} has no footer, the run did not finish; reading its chunks')
+        return scan_chunks(filepath), None
+    return footer['index'], footer
+
+
+def read_array(filepath, name, index=None):
+    '''
+    Read one array of a results file, seeking straight to its chunks.
+
+    :param index: Index of the file, from `read_index`; read when not given.
+    :return: NumPy array.
+    '''
+    if index is None:
+        index, _ = read_index(filepath)
+    entry = index[name]
+    dtype = dtype_from_json(entry['dtype'])
+    row_shape = entry['shape'][1:]
+    parts = []
+    with open(filepath, 'rb') as f:
+        for offset, rows in entry['chunks']:
+            f.seek(offset)
+            count = rows * int(np.prod(row_shape, dtype=np.int64))
+            parts.append(np.fromfile(f, dtype=dtype, count=count).reshape([rows] + row_shape))
+    if not parts:
+        return np.zeros(entry['shape'], dtype=dtype)
+    return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+
+def load_results(filepath):
+    '''
+    Read every array of a results file into memory.
+
+    :return: (dict of name -> array, footer dict). Files without a footer get
+             one with empty metadata and summary.
+    '''
+    index, footer = read_index(filepath)
+    if footer is None:
+        footer = {'version': FORMAT_VERSION, 'index': index, 'metadata': {}, 'summary': {}}
+    return {name: read_array(filepath, name, index) for name in index}, footer
+
+
+def export_csv(filepath, csv_filepath):
+    '''
+    Write a results file as a CSV file in the layout the simulation used to
+    write: one `key, v1, v2, ...` row per value.
+
+    :param filepath: Results file.
+    :param csv_filepath: CSV file to write.
+    '''
+    arrays, footer = load_results(filepath)
+    metadata = footer['metadata']
+    with open(csv_filepath, mode='w') as csvfile:
+        writer = csv.writer(csvfile, dialect='excel')
+        writer.writerow(['title', metadata.get('title', '')])
+        writer.writerow(['author', metadata.get('author', '')])
+        for name, values in arrays.items():
+            if name == 'packets' or name.startswith(('paths/', 'delays/')):
+                continue
+            key = name.split('/')[-1] if name.startswith('network/') else '_'.join(name.split('/')[1:])
+            if values.ndim > 1:
+                writer.writerow([key] + [tuple(value) for value in values.tolist()])
+            else:
+                writer.writerow([key] + values.tolist())
+        for key, value in metadata.items():
+            if key not in ('title', 'author') and isinstance(value, (str, int, float)):
+                writer.writerow([key, value])
+        for key, value in footer['summary'].items():
+            if not isinstance(value, dict):
+                writer.writerow([key, value])
+        if 'packets' in arrays:
+            paths = split_paths(arrays['paths/nodes'], arrays['paths/lengths'])
+            name_for = {node['id']: node['node'] for node in metadata.get('nodes', [])}
+            writer.writerows(csv_packet_rows(arrays['packets'], [path.tolist() for path in paths], name_for))
+
+
+SUMMARY_EXTENSION = '.summary.json'
+
+
+def summary_filepath(filepath):
+    '''
+    :return: Path of the summary file of the run file `filepath`.
+    '''
+    return os.path.splitext(filepath)[0] + SUMMARY_EXTENSION
+
+
+def write_summary(filepath, summary):
+    '''
+    Write the summary file of the run file `filepath`.
+
+    :param summary: JSON serializable dict of summary values.
+    '''
+    with open(summary_filepath(filepath), 'w') as f:
+        json.dump(summary, f, indent=1, default=str)
+
+
+def read_summary(filepath):
+    '''
+    :return: Summary dict of the run file `filepath`, or None if it has no
+             summary file or the run file is newer than it.
+    '''
+    try:
+        with open(summary_filepath(filepath)) as f:
+            if os.fstat(f.fileno()).st_mtime < os.stat(filepath).st_mtime:
+                return None
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _check_header(f, filepath):
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size or _HEADER.unpack(header)[0] != MAGIC:
+        raise Exception(f'Incorrect results file {filepath}; must start with {MAGIC}')
+    version = _HEADER.unpack(header)[1]
+    if version != FORMAT_VERSION:
+        raise Exception(f'Incorrect results file version {version} of {filepath}; '
+                        f'must be {FORMAT_VERSION}')
+
+
+def _file_size(f):
+    position = f.tell()
+    f.seek(0, 2)
+    size = f.tell()
+    f.seek(position)
+    return size
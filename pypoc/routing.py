@@ -0,0 +1,361 @@
+'''
+Routing helpers shared by all nodes of a PyPocNetwork.
+
+Path computation used to run one Dijkstra per generated packet. The classes
+here keep the results around until the topology changes or the `Channel`
+weights they were computed with are considered too old. Both expose the same
+interface, selected with the `routing` key of the configuration:
+
+    'shortest-path': RouteCache, source routing with a full path per packet.
+    'next-hop': NextHopTable, hop-by-hop forwarding towards the destination.
+
+`Channel` weights are mostly 0 or small queue sums, so many paths tie. The
+`routing-backend` key selects the Dijkstra that breaks those ties:
+
+    'networkx': networkx on the network itself, with the weights read from
+                its GraphStore; the same paths as earlier versions of PyPoc.
+    'scipy': scipy on the CSR matrix of the GraphStore. Faster, but ties go
+             to other paths, so results under load differ from 'networkx'.
+'''
+
+__author__ = 'Hans Hofner'
+
+import logging
+
+import networkx as nx
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+
+class PathTable:
+    '''
+    Interned, immutable paths handed out to packets.
+
+    Packets hold a path tuple and a hop index into it. Handing the same tuple
+    to every packet that takes the same route keeps one copy per route instead
+    of one per packet. Routing objects clear their table when the edges
+    change; packets keep the tuples they already hold.
+    '''
+    def __init__(self):
+        self._paths = {}  # Path tuple -> the same, canonical tuple
+        self._extensions = {}  # (id(path), node) -> (path, path + (node,))
+
+    def intern(self, path):
+        '''
+        :param path: Sequence of Node objects.
+        :return: The canonical tuple equal to `path`.
+        '''
+        path = tuple(path)
+        return self._paths.setdefault(path, path)
+
+    def extend(self, path, node):
+        '''
+        :return: Interned `path + (node,)`; repeated calls for the same
+                 interned path and node cost one dict lookup.
+        '''
+        key = (id(path), node)
+        entry = self._extensions.get(key)
+        # The entry holds on to `path`, so its id can not be reused while cached
+        if entry is None or entry[0] is not path:
+            entry = (path, self.intern(path + (node,)))
+            self._extensions[key] = entry
+        return entry[1]
+
+    def clear(self):
+        self._paths.clear()
+        self._extensions.clear()
+
+    def __len__(self):
+        return len(self._paths)
+
+
+ROUTING_BACKENDS = ('networkx', 'scipy')
+
+# Index of a node without predecessor, as scipy marks unreached nodes
+_NO_PREDECESSOR = -9999
+
+
+def _shortest_path_tree(store, root, transposed=False):
+    '''
+    :return: Predecessor array of a Dijkstra search from `root` over the
+             `Channel` weights of `store`, -9999 for unreached nodes. With
+             `transposed` the search runs on the reversed graph.
+    '''
+    return dijkstra(store.matrix('Channel', transposed=transposed), indices=store.index_for[root],
+                    return_predecessors=True)[1]
+
+
+def _next_hop_tree(network, destination):
+    '''
+    :return: Array over the node indices of the GraphStore of `network` with
+             the index of the first predecessor networkx finds in a Dijkstra
+             search from `destination` over the reversed network, that is the
+             next hop towards it; _NO_PREDECESSOR for unreached nodes.
+    '''
+    store = network.graph_store
+    predecessors, _ = nx.dijkstra_predecessor_and_distance(
+        network.reverse(copy=False), destination, weight=store.weight_function('Channel', reverse=True))
+    tree = np.full(len(store.nodes), _NO_PREDECESSOR, dtype=np.int64)
+    index_for = store.index_for
+    for node, hops in predecessors.items():
+        if hops:
+            tree[index_for[node]] = index_for[hops[0]]
+    return tree
+
+
+def _check_backend(backend):
+    if backend not in ROUTING_BACKENDS:
+        raise Exception(f'Incorrect routing backend {backend}; must be one of {ROUTING_BACKENDS}')
+
+
+def _equal_cost_paths(routing, source, destination):
+    '''
+    Every shortest path from `source` to `destination` weighted by `Channel`,
+    in the order networkx lists them, cached on `routing` under the same rules
+    as its trees or tables.
+
+    :return: List of interned tuples of Node objects.
+    :raises nx.NetworkXNoPath: if `destination` is unreachable.
+    '''
+    network = routing.network
+    store = network.graph_store
+    if source not in store or destination not in store:
+        raise nx.exception.NetworkXNoPath(f'No path from {source} to {destination}')
+    version = store.versions['Channel']
+    computed = routing._equal_cost.get(None)
+    if computed is None or not (computed[1] == version or network.tick - computed[0] <= routing.max_age):
+        routing._equal_cost.clear()
+        routing._equal_cost[None] = (network.tick, version)
+    paths = routing._equal_cost.get((source, destination))
+    if paths is None:
+        weight = store.weight_function('Channel')
+        paths = [routing.paths.intern(path)
+                 for path in nx.all_shortest_paths(network, source, destination, weight=weight)]
+        routing._equal_cost[(source, destination)] = paths
+    return paths
+
+
+class RouteCache:
+    '''
+    Cache of shortest paths keyed by source. With the scipy backend a path to
+    any destination is read off the shortest path tree of its source; with
+    networkx every path is searched for on its own, as networkx does.
+
+    Entries are dropped whenever the edge set changes (`invalidate`, called by
+    the network), and are otherwise reused as long as the `Channel` weights did
+    not change, or for `max_age` ticks after being computed. `Channel` weights
+    only change at the end of a tick, so the default `max_age` of 0 gives the
+    same paths as computing them per packet.
+    '''
+    def __init__(self, network, max_age=0, backend='networkx'):
+        '''
+        :param network: PyPocNetwork the paths are computed on.
+        :param max_age: Number of ticks a path may be reused while the `Channel`
+                        weights it was computed with change.
+        :param backend: One of ROUTING_BACKENDS.
+        '''
+        _check_backend(backend)
+        self.network = network
+        self.max_age = max_age
+        self.backend = backend
+        self.epoch = 0
+        self._trees = {}
+        self._equal_cost = {}  # See _equal_cost_paths
+        self.paths = PathTable()
+
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        '''
+        Forget every cached path. Call whenever edges are added or removed.
+        '''
+        self.epoch += 1
+        self._trees.clear()
+        self._equal_cost.clear()
+        self.paths.clear()
+
+    def shortest_path(self, source, destination):
+        '''
+        Shortest path from `source` to `destination` weighted by `Channel`.
+
+        :return: Interned tuple of Node objects.
+        :raises nx.NetworkXNoPath: if `destination` is unreachable.
+        '''
+        store = self.network.graph_store
+        if source is destination:
+            return self.paths.intern((source,))
+        if source not in store or destination not in store:
+            raise nx.exception.NetworkXNoPath(f'No path from {source} to {destination}')
+
+        network = self.network
+        version = store.versions['Channel']
+        entry = self._trees.get(source)
+        if entry is not None and (entry[1] == version or network.tick - entry[0] <= self.max_age):
+            self.hits += 1
+        else:
+            self.misses += 1
+            tree = _shortest_path_tree(store, source) if self.backend == 'scipy' else None
+            entry = (network.tick, version, tree, {})
+            self._trees[source] = entry
+        predecessors, path_for = entry[2], entry[3]
+
+        path = path_for.get(destination)
+        if path is not None:
+            return path
+        if predecessors is None:
+            path = nx.shortest_path(network, source, destination, weight=store.weight_function('Channel'))
+            path = path_for[destination] = self.paths.intern(path)
+            return path
+        index = store.index_for[destination]
+        if predecessors[index] < 0:
+            raise nx.exception.NetworkXNoPath(f'No path from {source} to {destination}')
+        path = []
+        while index >= 0:
+            path.append(store.nodes[index])
+            index = predecessors[index]
+        path.reverse()
+        path = path_for[destination] = self.paths.intern(path)
+        return path
+
+    def equal_cost_paths(self, source, destination):
+        '''
+        :return: List of every shortest path from `source` to `destination`,
+                 to pick from at random where ties should be broken evenly.
+        :raises nx.NetworkXNoPath: if `destination` is unreachable.
+        '''
+        return _equal_cost_paths(self, source, destination)
+
+    def route(self, source, destination):
+        '''
+        Route for a new packet.
+
+        :return: (path, hop_table) -- the planned path and the table to keep
+                 following once it runs out, None as the path is complete.
+        :raises nx.NetworkXNoPath: if `destination` is unreachable.
+        '''
+        return self.shortest_path(source, destination), None
+
+    def __repr__(self):
+        return f'RouteCache(epoch:{self.epoch}, sources:{len(self._trees)}, hits:{self.hits}, misses:{self.misses})'
+
+
+class NextHopTable:
+    '''
+    Next hop towards every destination, shared by all nodes.
+
+    There are far fewer destinations than sources, so instead of one forward
+    Dijkstra per source this runs one Dijkstra per destination on the reversed
+    graph. The predecessor of a node in that search is its next hop towards
+    the destination, so a packet only has to carry its destination and look
+    up where to go at every hop. Tables follow the same invalidation rules as
+    RouteCache.
+    '''
+    def __init__(self, network, max_age=0, backend='networkx'):
+        '''
+        :param network: PyPocNetwork the tables are computed on.
+        :param max_age: Number of ticks a table may be reused while the `Channel`
+                        weights it was computed with change.
+        :param backend: One of ROUTING_BACKENDS.
+        '''
+        _check_backend(backend)
+        self.network = network
+        self.max_age = max_age
+        self.backend = backend
+        self.epoch = 0
+        self._tables = {}
+        self._equal_cost = {}  # See _equal_cost_paths
+        self.paths = PathTable()
+
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        '''
+        Forget every table. Call whenever edges are added or removed.
+        '''
+        self.epoch += 1
+        self._tables.clear()
+        self._equal_cost.clear()
+        self.paths.clear()
+
+    def table_for(self, destination):
+        '''
+        :return: Array over the node indices of the GraphStore with the index
+                 of the next hop towards `destination`, negative for nodes
+                 that cannot reach it.
+        '''
+        network = self.network
+        store = network.graph_store
+        version = store.versions['Channel']
+        entry = self._tables.get(destination)
+        if entry is not None and (entry[1] == version or network.tick - entry[0] <= self.max_age):
+            self.hits += 1
+        else:
+            self.misses += 1
+            if self.backend == 'scipy':
+                tree = _shortest_path_tree(store, destination, transposed=True)
+            else:
+                tree = _next_hop_tree(network, destination)
+            entry = (network.tick, version, tree)
+            self._tables[destination] = entry
+        return entry[2]
+
+    def next_hop(self, node, destination):
+        '''
+        :return: Next Node from `node` towards `destination`, or None if there
+                 is no route.
+        '''
+        store = self.network.graph_store
+        index = store.index_for.get(node)
+        if index is None or destination not in store:
+            return None
+        hop = self.table_for(destination)[index]
+        if hop < 0:
+            return None
+        return store.nodes[hop]
+
+    def shortest_path(self, source, destination):
+        '''
+        Path from `source` to `destination` obtained by following next hops.
+
+        :return: Interned tuple of Node objects.
+        :raises nx.NetworkXNoPath: if `destination` is unreachable.
+        '''
+        path = [source]
+        while path[-1] is not destination:
+            hop = self.next_hop(path[-1], destination)
+            if hop is None:
+                raise nx.exception.NetworkXNoPath(f'No path from {source} to {destination}')
+            path.append(hop)
+        return self.paths.intern(path)
+
+    def equal_cost_paths(self, source, destination):
+        '''
+        :return: List of every shortest path from `source` to `destination`,
+                 to pick from at random where ties should be broken evenly.
+        :raises nx.NetworkXNoPath: if `destination` is unreachable.
+        '''
+        return _equal_cost_paths(self, source, destination)
+
+    def route(self, source, destination):
+        '''
+        Route for a new packet: the packet starts at `source` and follows this
+        table the rest of the way.
+
+        :return: (path, hop_table)
+        :raises nx.NetworkXNoPath: if `destination` is unreachable.
+        '''
+        if source is not destination and self.next_hop(source, destination) is None:
+            raise nx.exception.NetworkXNoPath(f'No path from {source} to {destination}')
+        return self.paths.intern((source,)), self
+
+    def __repr__(self):
+        return f'NextHopTable(epoch:{self.epoch}, destinations:{len(self._tables)}, hits:{self.hits}, misses:{self.misses})'
+
+
+ROUTING_METHODS = {'shortest-path': RouteCache,
+                   'next-hop': NextHopTable}
@@ -0,0 +1,95 @@
+'''
+Defines the EventScheduler used by the `event` engine of PyPocNetwork.
+
+Events are kept in a priority queue ordered by (tick, order), so the network
+only does work at ticks where something actually happens instead of stepping
+every node on every tick. Node events are ordered within a tick by the node's
+position in the network, which keeps the same "who runs first" behaviour as
+the tick engine.
+'''
+
+__author__ = 'Hans Hofner'
+
+import heapq
+import itertools
+import logging
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+
+class EventScheduler:
+    '''
+    Priority queue of simulation events. A node is scheduled at most once at a
+    time; scheduling it again at an earlier tick supersedes the later entry,
+    which is then skipped when it comes up.
+    '''
+    NODE = 'node'
+    TOPOLOGY = 'topology'
+
+    # Topology events sort after every node event of the same tick
+    LAST = float('inf')
+
+    def __init__(self):
+        self._events = []
+        self._counter = itertools.count()
+        self._node_ticks = {}  # Node -> tick of its live event
+
+    def schedule(self, tick, kind, target=None, order=LAST):
+        '''
+        Push an event.
+
+        :param tick: Integer tick at which the event fires.
+        :param kind: One of EventScheduler.NODE or EventScheduler.TOPOLOGY.
+        :param target: Object the event applies to (a Node for NODE events).
+        :param order: Ordering of events within the same tick.
+        '''
+        heapq.heappush(self._events, (tick, order, next(self._counter), kind, target))
+
+    def schedule_node(self, node, tick, order):
+        '''
+        Schedule `node` to run at `tick`, unless it already runs at or before it.
+        '''
+        scheduled_tick = self._node_ticks.get(node)
+        if scheduled_tick is not None and scheduled_tick <= tick:
+            return
+        self._node_ticks[node] = tick
+        self.schedule(tick, EventScheduler.NODE, node, order)
+
+    def is_scheduled(self, node):
+        return node in self._node_ticks
+
+    def peek(self):
+        '''
+        :return: (tick, kind) of the next live event, or None if empty.
+        '''
+        self._drop_stale()
+        if not self._events:
+            return None
+        tick, _, _, kind, _ = self._events[0]
+        return tick, kind
+
+    def pop(self):
+        '''
+        :return: (tick, order, kind, target) of the next live event.
+        '''
+        self._drop_stale()
+        tick, order, _, kind, target = heapq.heappop(self._events)
+        if kind == EventScheduler.NODE:
+            del self._node_ticks[target]
+        return tick, order, kind, target
+
+    def _drop_stale(self):
+        while self._events:
+            tick, _, _, kind, target = self._events[0]
+            if kind == EventScheduler.NODE and self._node_ticks.get(target) != tick:
+                heapq.heappop(self._events)
+            else:
+                return
+
+    def __len__(self):
+        self._drop_stale()
+        return len(self._events)
+
+    def __repr__(self):
+        return f'EventScheduler(events:{len(self._events)}, nodes:{len(self._node_ticks)})'
@@ -0,0 +1,79 @@
+'''
+Running the simulation from Python.
+
+    from pypoc.simulation import run_simulation
+
+    run = run_simulation('config.toml', {'nodes.src-nodes.count': 50})
+    run['network/throughput_list']
+    run.value('packet_drop_value')
+    run.delay_histogram().percentile(99)
+
+`run_simulation` runs the network in the calling process and returns its
+results, by default without writing any file, so notebooks, sweeps and
+process pools can run many simulations from one warm interpreter.
+'''
+
+__author__ = 'Hans Hofner'
+
+import contextlib
+import copy
+import logging
+import os
+
+import toml
+
+from pypoc.network import PyPocNetwork
+from pypoc.reader import ArrayResults, read_results
+from pypoc.sweep import set_key
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+
+def run_simulation(configuration, overrides=None, output=None, quiet=False, profiler=None):
+    '''
+    Run the simulation once.
+
+    :param configuration: Configuration dict, or path of a TOML file. It is
+                          not changed.
+    :param overrides: Dict of dotted key -> value to set in the
+                      configuration, e.g. {'global.minutes': 2}; keys that
+                      are not in it are added, e.g. {'global.seed': 0}.
+    :param output: Path of a run file to write (and its summary file),
+                   '.csv' for a CSV file; a bare file name goes to
+                   ./output_data/ for CSV files. None to keep the results in
+                   memory.
+    :param quiet: Silence the printing and progress bar of the run.
+    :param profiler: pypoc.profiler.Profiler to time the phases of the run,
+                     or None.
+    :return: ArrayResults held in memory, or, with `output`, the reader of
+             the run file written (see pypoc.reader.read_results).
+    '''
+    if isinstance(configuration, (str, os.PathLike)):
+        configuration = toml.load(configuration)
+    configuration = copy.deepcopy(configuration)
+    for key, value in (overrides or {}).items():
+        set_key(configuration, key, value, create=True)
+
+    if output is None:
+        configuration['global']['output-format'] = 'memory'
+    elif str(output).endswith('.csv'):
+        configuration['global']['output-format'] = 'csv'
+    else:
+        configuration['global']['output-format'] = 'pypoc'
+
+    network = PyPocNetwork()
+    with contextlib.ExitStack() as stack:
+        if quiet:
+            devnull = stack.enter_context(open(os.devnull, 'w'))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+            stack.enter_context(contextlib.redirect_stderr(devnull))
+        network.run_network_with(configuration, filename=None if output is None else str(output),
+                                 profiler=profiler)
+
+    if output is not None:
+        return read_results(network.run_filepath)
+    results = network.results
+    summary = dict(results.summary)
+    summary.update(network.run_summary())
+    return ArrayResults(results.arrays, results.metadata, summary)
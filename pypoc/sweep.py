@@ -0,0 +1,200 @@
+'''
+Parameter sweeps: runs of the simulation over the values of one key of the
+configuration, spread over a pool of worker processes.
+
+    points = sweep_points(configuration, 'nodes.src-nodes.count', range(50, 250, 5), 'BASELINE')
+    for result in run_sweep(points, 'output_data', workers=8):
+        print(result)
+
+The workers run the simulation in process, so the simulator (and everything
+it imports) is imported once per worker, not once per run. Results are
+yielded as the runs finish, in no particular order; a run that fails is
+yielded with its traceback and the sweep carries on with the others.
+
+With a ResultCache, points that were run before (same configuration, seed
+and simulator) are taken from the cache instead of being run again.
+
+Every point runs with the `seed` of the `[global]` configuration (default
+SweepPoint.default_seed), so a point gives the same result whichever worker
+runs it and whatever ran there before.
+'''
+
+__author__ = 'Hans Hofner'
+
+import copy
+import logging
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import toml
+
+from pypoc.results import ResultsWriter
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+
+class SweepPoint:
+    '''
+    One run of a sweep: a title and the configuration to run.
+    '''
+    default_seed = 0
+
+    def __init__(self, title, configuration):
+        self.title = title
+        self.configuration = configuration
+        self.configuration['title'] = title
+        self.configuration['global'].setdefault('seed', SweepPoint.default_seed)
+
+    def __repr__(self):
+        return f'SweepPoint({self.title})'
+
+
+class SweepResult:
+    '''
+    Outcome of a SweepPoint: the run file and summary of the run, or the
+    traceback of the error that stopped it.
+    '''
+    def __init__(self, point, filepath=None, summary=None, error=None, cached=False):
+        self.point = point
+        self.filepath = filepath
+        self.summary = summary
+        self.error = error
+        self.cached = cached  # Taken from the ResultCache rather than run
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def __repr__(self):
+        if self.failed:
+            return f'SweepResult({self.point.title}, FAILED: {self.error.strip().splitlines()[-1]})'
+        return f'SweepResult({self.point.title}, {self.filepath}{", cached" if self.cached else ""})'
+
+
+def set_key(configuration, key, value, create=False):
+    '''
+    Set a key of the configuration given as a dotted path, e.g.
+    'nodes.src-nodes.count'.
+
+    :param create: Add the key (and its tables) if it is not in the
+                   configuration, e.g. for keys with a default such as
+                   'global.seed'.
+    :raise KeyError: If the key is not in the configuration and `create` is
+                     not set.
+    '''
+    keys = key.split('.')
+    table = configuration
+    for name in keys[:-1]:
+        if create:
+            table = table.setdefault(name, {})
+        elif name not in table:
+            raise KeyError(f'{key} is not in the configuration')
+        else:
+            table = table[name]
+    if keys[-1] not in table and not create:
+        raise KeyError(f'{key} is not in the configuration')
+    table[keys[-1]] = value
+
+
+def sweep_points(configuration, key, values, name):
+    '''
+    :param key: Dotted path of the key to sweep, e.g. 'nodes.src-nodes.count'.
+    :param values: Values of the key, one point each.
+    :param name: Name of the sweep; points are titled `<name>_<key>_<value>`.
+    :return: List of SweepPoint.
+    '''
+    points = []
+    for value in values:
+        point_configuration = copy.deepcopy(configuration)
+        # NumPy scalars (e.g. from np.arange) are not TOML serializable
+        value = value.item() if hasattr(value, 'item') else value
+        set_key(point_configuration, key, value)
+        points.append(SweepPoint(f'{name}_{key}_{value}', point_configuration))
+    return points
+
+
+def point_filepath(point, output_dir):
+    '''
+    :return: Path of the run file of a SweepPoint in `output_dir`.
+    '''
+    configuration = point.configuration
+    extension = '.csv' if configuration['global'].get('output-format') == 'csv' else ResultsWriter.extension
+    return os.path.join(output_dir, point.title + extension)
+
+
+def run_point(point, output_dir):
+    '''
+    Run a SweepPoint in this process, writing its configuration and run file
+    to `output_dir`.
+
+    :return: SweepResult.
+    '''
+    # Imported here, as the workers are the ones that run the simulation
+    from pypoc.simulation import run_simulation
+    from pypoc.reader import run_summary
+
+    configuration = point.configuration
+    try:
+        with open(os.path.join(output_dir, point.title + '.toml'), 'w') as f:
+            toml.dump(configuration, f)
+        run = run_simulation(configuration, output=point_filepath(point, output_dir))
+        return SweepResult(point, run.filepath, run_summary(run.filepath))
+    except Exception:
+        return SweepResult(point, error=traceback.format_exc())
+
+
+def run_sweep(points, output_dir, workers=None, cache=None):
+    '''
+    Run SweepPoints over a pool of worker processes.
+
+    :param output_dir: Directory of the run files.
+    :param workers: Number of worker processes; None for one per CPU, 0 to
+                    run the points one by one in this process.
+    :param cache: ResultCache to take runs from and store them in, or None.
+                  Cached points are yielded first, without running them.
+    :return: Generator of SweepResult, as the runs finish.
+    '''
+    if workers is not None and workers < 0:
+        raise Exception(f'Incorrect workers {workers}; must be 0 or more')
+    if not os.path.isdir(output_dir):
+        raise Exception(f'`{output_dir}` is not a directory')
+
+    if cache is not None:
+        missed = []
+        for point in points:
+            filepath = point_filepath(point, output_dir)
+            summary = cache.fetch(point.configuration, filepath)
+            if summary is None:
+                missed.append(point)
+            else:
+                yield SweepResult(point, filepath, summary, cached=True)
+        points = missed
+
+    for result in _run_points(points, output_dir, workers):
+        if cache is not None and not result.failed:
+            cache.put(result.point.configuration, result.filepath)
+        yield result
+
+    if cache is not None:
+        cache.evict()
+
+
+def _run_points(points, output_dir, workers):
+    if workers == 0:
+        for point in points:
+            yield run_point(point, output_dir)
+        return
+    if not points:
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_point, point, output_dir): point for point in points}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception:
+                # The worker itself died (e.g. killed); the pool is broken then
+                # and the remaining points come back here as failed as well
+                yield SweepResult(futures[future], error=traceback.format_exc())
@@ -0,0 +1,269 @@
+'''
+Per-node telemetry: the metrics a node records while the simulation runs.
+
+Nodes used to append to plain lists on every tick and for every packet,
+keeping everything until the end of the run. Here every metric has a
+retention policy, set per metric in the `[telemetry]` table of the
+configuration:
+
+    "all"    keep every sample (the previous behaviour).
+    "ring"   keep the last `ring-size` samples in a preallocated buffer.
+    "count"  only count the samples.
+    "none"   record nothing.
+
+Per-tick series (queue size, position) are stored in NumPy arrays and are
+sampled every `interval` ticks. Packet events are counted by default instead
+of keeping a reference to every packet.
+'''
+
+__author__ = 'Hans Hofner'
+
+import logging
+from collections import deque
+
+import numpy as np
+
+logging.basicConfig(level=logging.ERROR)
+LOGGER = logging.getLogger(__name__)
+
+RETENTIONS = {'all', 'ring', 'count', 'none'}
+
+# Retention of metrics that the configuration does not mention
+DEFAULT_RETENTION = 'all'
+DEFAULT_RETENTION_FOR = {'transmitted_packets': 'count',
+                         'relayed_packets': 'count',
+                         'received_packets': 'count',
+                         'dropped_packets': 'count'}
+
+
+class TelemetrySettings:
+    def __init__(self, section=None):
+        '''
+        :param section: The `[telemetry]` table of the configuration: optional
+                        `interval` and `ring-size`, and a retention per metric.
+        '''
+        section = dict(section or {})
+        self.interval = section.pop('interval', 1)
+        self.ring_size = section.pop('ring-size', 1000)
+        if self.interval < 1:
+            raise Exception(f'Incorrect telemetry interval {self.interval}; must be at least 1')
+
+        self.retention_for = dict(DEFAULT_RETENTION_FOR)
+        for name, retention in section.items():
+            if retention not in RETENTIONS:
+                raise Exception(f'Incorrect retention {retention} for {name}; '
+                                f'must be one of {RETENTIONS}')
+            self.retention_for[name] = retention
+
+    def retention(self, name):
+        return self.retention_for.get(name, DEFAULT_RETENTION)
+
+
+# Settings used by nodes created from now on; see `configure`
+SETTINGS = TelemetrySettings()
+
+
+def configure(section):
+    '''
+    Set the telemetry settings for nodes created after this call.
+
+    :param section: The `[telemetry]` table of the configuration, or None.
+    '''
+    global SETTINGS
+    SETTINGS = TelemetrySettings(section)
+
+
+class Series:
+    '''
+    Samples of a per-tick value, taken on ticks that are a multiple of
+    `interval`.
+    '''
+    def __init__(self, retention, interval=1, ring_size=1000, width=None, dtype=float):
+        '''
+        :param width: Number of values per sample (e.g. 3 for a position), or
+                      None for scalars.
+        '''
+        self.retention = retention
+        self.interval = interval
+        self.count = 0  # Samples taken
+        self.last_value = None
+        self._taken = 0  # Samples handed over by `take`
+
+        shape = () if width is None else (width,)
+        capacity = ring_size if retention == 'ring' else (64 if retention == 'all' else 0)
+        self._samples = np.zeros((capacity,) + shape, dtype=dtype)
+
+    def record(self, tick, value):
+        self.last_value = value
+        if tick % self.interval:
+            return
+        self._store(value, 1)
+
+    def fill(self, first_tick, last_tick, value):
+        '''
+        Record `value` for every tick from `first_tick` to `last_tick`, both
+        included.
+        '''
+        self.last_value = value
+        interval = self.interval
+        samples = last_tick // interval - (first_tick - 1) // interval
+        if samples > 0:
+            self._store(value, samples)
+
+    def _store(self, value, repeat):
+        retention = self.retention
+        if retention == 'all':
+            start = self.count - self._taken
+            end = start + repeat
+            if end > len(self._samples):
+                grown = np.zeros((max(end, 2 * len(self._samples)),) + self._samples.shape[1:],
+                                 dtype=self._samples.dtype)
+                grown[:start] = self._samples[:start]
+                self._samples = grown
+            self._samples[start:end] = value
+        elif retention == 'ring':
+            size = len(self._samples)
+            positions = np.arange(self.count, self.count + min(repeat, size)) % size
+            self._samples[positions] = value
+        self.count += repeat
+
+    def values(self):
+        '''
+        :return: Array of the retained samples, oldest first.
+        '''
+        if self.retention == 'all':
+            return self._samples[:self.count - self._taken]
+        if self.retention == 'ring':
+            size = len(self._samples)
+            if self.count <= size:
+                return self._samples[:self.count]
+            return np.roll(self._samples, -(self.count % size), axis=0)
+        return self._samples[:0]
+
+    def take(self):
+        '''
+        Hand over the samples recorded since the last call and stop retaining
+        them, to stream them out. Only for retention "all"; the others retain
+        a bounded number of samples.
+
+        :return: Array of the samples, oldest first, or None.
+        '''
+        if self.retention != 'all':
+            return None
+        values = self.values().copy()
+        self._taken = self.count
+        return values
+
+    def export(self):
+        '''
+        :return: List of the retained samples, the sample count for "count",
+                 or None for "none".
+        '''
+        if self.retention == 'count':
+            return self.count
+        if self.retention == 'none':
+            return None
+        values = self.values().tolist()
+        if self._samples.ndim > 1:
+            values = [tuple(value) for value in values]
+        return values
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f'Series(retention:{self.retention}, interval:{self.interval}, samples:{self.count})'
+
+
+class EventLog:
+    '''
+    Things that happen to a node (packets it sends, losses, ...), not tied to
+    every tick.
+    '''
+    def __init__(self, retention, ring_size=1000):
+        self.retention = retention
+        self.count = 0
+        if retention == 'all':
+            self._items = []
+        elif retention == 'ring':
+            self._items = deque(maxlen=ring_size)
+        else:
+            self._items = ()
+
+    def record(self, item):
+        self.count += 1
+        if self.retention in ('all', 'ring'):
+            self._items.append(item)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return self.count
+
+    def take(self):
+        '''
+        Hand over the events recorded since the last call and stop retaining
+        them. Only for retention "all".
+
+        :return: List of the events, or None.
+        '''
+        if self.retention != 'all':
+            return None
+        items, self._items = self._items, []
+        return items
+
+    def export(self):
+        if self.retention == 'count':
+            return self.count
+        if self.retention == 'none':
+            return None
+        return list(self._items)
+
+    def __repr__(self):
+        return f'EventLog(retention:{self.retention}, events:{self.count})'
+
+
+class Telemetry:
+    '''
+    The metrics of one node, by name. Metrics are created with `series` and
+    `log`, and take their retention from the settings active at that time.
+    '''
+    def __init__(self, settings=None):
+        self.settings = SETTINGS if settings is None else settings
+        self._metrics = {}
+
+    def series(self, name, width=None, dtype=float):
+        settings = self.settings
+        self._metrics[name] = Series(settings.retention(name), settings.interval,
+                                     settings.ring_size, width=width, dtype=dtype)
+        return self._metrics[name]
+
+    def log(self, name):
+        settings = self.settings
+        self._metrics[name] = EventLog(settings.retention(name), settings.ring_size)
+        return self._metrics[name]
+
+    def __getitem__(self, name):
+        return self._metrics[name]
+
+    def __contains__(self, name):
+        return name in self._metrics
+
+    def keys(self):
+        return self._metrics.keys()
+
+    def export(self):
+        '''
+        :return: Dict of metric name -> exported values, leaving out metrics
+                 with retention "none".
+        '''
+        exported = {}
+        for name, metric in self._metrics.items():
+            values = metric.export()
+            if values is not None:
+                exported[name] = values
+        return exported
+
+    def __repr__(self):
+        return f'Telemetry({list(self._metrics.values())})'
@@ -8,8 +8,8 @@ import numpy as np
 import toml
 from pypoc.node import (Packet, Node, VaryingTransmitNode, 
                 VaryingRelayNode, MovingNode, RestrictedNode)
-from pypoc.qnode import QNode
 from pypoc.mobility import MobilityEnum
+from pypoc.linkrules import TOPOLOGY_RULES, positions_of
 
 seed = 62
 np.random.seed(seed)  # Randomizes UE positions
@@ -38,6 +38,8 @@ class Topology:
             # Create nodes
             for c in range(count):
                 if node == 'q-stations':
+                    # Imported here, as it pulls in torch
+                    from pypoc.qnode import QNode
                     LOGGER.debug(f'node_type:{node_type}')
                     new_node = QNode(node_type=node_type,
                                     step_value=0,
@@ -57,6 +59,9 @@ class Topology:
                 new_node.position = self.get_position(position, area, c)
                 self.node_dict[node].append(new_node)
 
+        # Positions of every node class, in the same order as `node_dict`
+        self.positions_for = {node: positions_of(self.node_dict[node]) for node in self.node_dict}
+
         # Build connections
         if configuration['global']['link-foundation'] == 'distance':
             self.create_distance_links(configuration)
@@ -73,28 +78,6 @@ class Topology:
         if len(self.node_dict) == 0:
             raise Exception('No available nodes to make links.')
 
-        def is_distance_ok(node, node2):
-            if node.name == 'q-stations' or node2.name == 'q-stations':
-                return True
-
-            if node.name == 'base-stations' and \
-                node2.name == 'base-stations':
-                return True
-
-            if node.name == 'base-stations' or node2.name == 'base-stations':
-                if distance(node, node2) <= 55:
-                    return True
-
-            if node.name == 'uav-base-stations' or node2.name == 'uav-base-stations':
-                if distance(node, node2) <= 50:
-                    return True
-
-            if node.name == 'leo-satellites' or node2.name == 'leo-satellites':
-                if distance(node, node2) < 2000:
-                    return True
-
-            return False
-
         #print('Creating links between nodes...')
         edge_list = []
 
@@ -109,15 +92,19 @@ class Topology:
         # Start making connections
         for node_key in self.node_dict:
             viable_connections = connections_for[node_key]  # Get list of nodes it can connect to
-            for node in self.node_dict[node_key]:
-                for vn in viable_connections:
-                    for node2 in self.node_dict[vn]:
-                        if is_distance_ok(node, node2) and not node is node2:
-                            new_connection = (node, node2,
-                                              {'Bandwidth': downlink_bandwidth_for[node_key],
-                                               'TickValue': None,
-                                               })
-                            edge_list.append(new_connection)
+            # One matrix of allowed links per connected node class
+            link_masks = [TOPOLOGY_RULES.link_matrix(node_key, self.positions_for[node_key],
+                                                     vn, self.positions_for[vn],
+                                                     same_nodes=(node_key == vn))
+                          for vn in viable_connections]
+            for i, node in enumerate(self.node_dict[node_key]):
+                for vn, link_mask in zip(viable_connections, link_masks):
+                    for j in np.flatnonzero(link_mask[i]):
+                        new_connection = (node, self.node_dict[vn][j],
+                                          {'Bandwidth': downlink_bandwidth_for[node_key],
+                                           'TickValue': None,
+                                           })
+                        edge_list.append(new_connection)
 
         self.topology = edge_list
 
@@ -145,12 +132,6 @@ class Topology:
 
         return s
 
-def distance(node1, node2):
-    a = np.array(node1.position)
-    b = np.array(node2.position)
-    return np.linalg.norm(a-b)
-
-
 ###################################################################################################
 
 ###################################################################################################